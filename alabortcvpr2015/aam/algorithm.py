@@ -6,6 +6,10 @@ import numpy as np
 from menpofast.feature import gradient as fast_gradient
 from menpofast.utils import build_parts_image
 
+from alabortcvpr2015.warp import PiecewiseAffineWarp, is_piecewise_affine
+from alabortcvpr2015.batch import (LockstepState, batch_solve, batch_dot,
+                                   batch_results)
+
 from .result import AAMAlgorithmResult
 
 
@@ -42,6 +46,11 @@ class AAMAlgorithm(object):
     def run(self, image, initial_shape, max_iters=20, gt_shape=None, **kwargs):
         pass
 
+    @abc.abstractmethod
+    def run_batch(self, images, initial_shapes, max_iters=20, gt_shapes=None,
+                  **kwargs):
+        pass
+
 
 # Concrete Implementations of AAM Algorithm -----------------------------------
 
@@ -78,6 +87,11 @@ class PIC(AAMAlgorithm):
         pdm_prior = 1 / self.interface.eigenvalues
         self._j_prior = np.hstack((sim_prior, pdm_prior))
 
+        # the hessian is constant, hence so are the gauss-newton operators
+        self._pinv_j_po = np.linalg.solve(self._h, self._j_po.T)
+        self._inv_h = np.linalg.inv(self._h)
+        self._inv_h_prior = np.linalg.inv(self._h + np.diag(self._j_prior))
+
     def run(self, image, initial_shape, gt_shape=None, max_iters=20,
             prior=False):
 
@@ -100,7 +114,8 @@ class PIC(AAMAlgorithm):
             e = masked_m - masked_i
 
             # compute gauss-newton parameter updates
-            dp = self.interface.solve(self._h, self._j_po, e, prior)
+            dp = self.interface.solve_precomputed(self._pinv_j_po.dot(e),
+                                                  prior)
 
             # update transform
             target = self.transform.target
@@ -117,6 +132,41 @@ class PIC(AAMAlgorithm):
         return AAMAlgorithmResult(image, self, shape_parameters,
                                   gt_shape=gt_shape)
 
+    def run_batch(self, images, initial_shapes, gt_shapes=None, max_iters=20,
+                  prior=False):
+        r"""
+        Fits several images in lockstep, see :map:`LockstepState`. The
+        results are the same as the ones of :meth:`run` on every image.
+        """
+        state = LockstepState(self.transform, initial_shapes, self.eps)
+        # masked model mean
+        masked_m = self.appearance_model.mean().as_vector()[
+            self.interface.image_vec_mask]
+
+        for _ in xrange(max_iters):
+            if state.n_active == 0:
+                break
+
+            # warp images
+            # masked_i: n_active x n_pixels
+            masked_i = self.interface.warp_batch(
+                [images[n] for n in state.active],
+                state.active_targets())[:, self.interface.image_vec_mask]
+
+            # compute error images
+            e = masked_m - masked_i
+
+            # compute gauss-newton parameter updates
+            dp = self.interface.solve_precomputed_batch(
+                e.dot(self._pinv_j_po.T), state.active_parameters(), prior)
+
+            # update transforms and test convergence
+            state.update(dp)
+
+        # return algorithm results
+        return batch_results(AAMAlgorithmResult, images, self, state,
+                             gt_shapes)
+
 
 class AIC(AAMAlgorithm):
     r"""
@@ -195,6 +245,65 @@ class AIC(AAMAlgorithm):
                                   appearance_parameters=appearance_parameters,
                                   gt_shape=gt_shape)
 
+    def run_batch(self, images, initial_shapes, gt_shapes=None, max_iters=20,
+                  prior=False):
+        r"""
+        Fits several images in lockstep, see :map:`LockstepState`. The
+        results are the same as the ones of :meth:`run` on every image.
+        """
+        state = LockstepState(self.transform, initial_shapes, self.eps)
+        # initial appearance parameters
+        appearance_parameters = [[0] for _ in images]
+        # model mean
+        m = self.appearance_model.mean().as_vector()
+        # masked model mean
+        masked_m = m[self.interface.image_vec_mask]
+        n_parameters = self.transform.n_parameters
+
+        for _ in xrange(max_iters):
+            if state.n_active == 0:
+                break
+
+            # warp images
+            # masked_i: n_active x n_pixels
+            masked_i = self.interface.warp_batch(
+                [images[n] for n in state.active],
+                state.active_targets())[:, self.interface.image_vec_mask]
+
+            # reconstruct appearances
+            c = (masked_i - masked_m).dot(self._pinv_U)
+            t = c.dot(self._U.T) + m
+            for k, n in enumerate(state.active):
+                appearance_parameters[n].append(c[k])
+
+            # compute error images
+            e = t[:, self.interface.image_vec_mask] - masked_i
+
+            # compute hessians and jacobians, the gradient of every
+            # reconstructed appearance being different
+            h = np.empty((state.n_active, n_parameters, n_parameters))
+            je = np.empty((state.n_active, n_parameters))
+            for k in xrange(state.n_active):
+                self.template.from_vector_inplace(t[k])
+                nabla_t = self.interface.gradient(self.template)
+                j = self.interface.steepest_descent_images(nabla_t,
+                                                           self._dw_dp)
+                ja = self._inv_sigma2 * j
+                h[k] = ja.T.dot(j)
+                je[k] = ja.T.dot(e[k])
+
+            # compute gauss-newton parameter updates
+            dp = self.interface.solve_batch(h, je, state.active_parameters(),
+                                            prior)
+
+            # update transforms and test convergence
+            state.update(dp)
+
+        # return algorithm results
+        return batch_results(AAMAlgorithmResult, images, self, state,
+                             gt_shapes,
+                             appearance_parameters=appearance_parameters)
+
 
 # Abstract Interface for AAM interfaces ---------------------------------------
 
@@ -225,6 +334,28 @@ class AAMInterface(object):
     def solve(self, h, j, e, prior):
         pass
 
+    @abc.abstractmethod
+    def warp_batch(self, images, targets):
+        pass
+
+    @abc.abstractmethod
+    def solve_batch(self, h, je, p, prior):
+        pass
+
+    @abc.abstractmethod
+    def solve_precomputed(self, dp, prior):
+        r"""
+        Returns the parameter updates of an algorithm with a constant
+        hessian ``h``, given the gauss-newton updates ``dp = h^-1 j^T e``
+        obtained with its precomputed operators ``_inv_h`` and
+        ``_inv_h_prior``.
+        """
+        pass
+
+    @abc.abstractmethod
+    def solve_precomputed_batch(self, dp, p, prior):
+        pass
+
 
 # Concrete Implementations of AAM Interfaces ----------------------------------
 
@@ -254,6 +385,14 @@ class GlobalAAMInterface(AAMInterface):
 
         self.eigenvalues = self.algorithm.transform.pdm.model.eigenvalues
 
+        # the reference frame is fixed, hence so are the triangles and
+        # barycentric coordinates of its pixels
+        self._pwa = None
+        transform = self.algorithm.transform.transform
+        if is_piecewise_affine(transform):
+            self._pwa = PiecewiseAffineWarp(self.algorithm.template.mask,
+                                            transform.source)
+
     def dw_dp(self):
         dw_dp = np.rollaxis(self.algorithm.transform.d_dp(
             self.algorithm.template.mask.true_indices()), -1)
@@ -261,9 +400,23 @@ class GlobalAAMInterface(AAMInterface):
                                                dw_dp.shape[2]))
 
     def warp(self, image):
+        if self._pwa is not None:
+            # the warped image is only used until the next iteration
+            return self._pwa.warp(image, self.algorithm.transform.target,
+                                  reuse_buffer=True)
         return image.warp_to_mask(self.algorithm.template.mask,
                                   self.algorithm.transform)
 
+    def warp_batch(self, images, targets):
+        # vectorized warped images: n_images x (n_channels x n_pixels)
+        if self._pwa is not None:
+            return self._pwa.warp_vectors(images, targets)
+        vectors = []
+        for image, target in zip(images, targets):
+            self.algorithm.transform.set_target(target)
+            vectors.append(self.warp(image).as_vector())
+        return np.array(vectors)
+
     def gradient(self, image):
         return image.gradient(
             nullify_values_at_mask_boundaries=True).as_vector().reshape(
@@ -302,6 +455,64 @@ class GlobalAAMInterface(AAMInterface):
 
         return dp
 
+    def solve_batch(self, h, je, p, prior):
+        # h:  [n_images x] n_params x n_params
+        # je: n_images x n_params
+        # p:  n_images x n_params
+        t = self.algorithm.transform
+        # jp depends on the state of the transform of every image
+        jp = np.empty((p.shape[0],) + (p.shape[1],) * 2)
+        for k, p_k in enumerate(p):
+            t.from_vector_inplace(p_k)
+            jp[k] = t.jp()
+
+        if prior:
+            inv_h = np.linalg.inv(h)
+            dp = batch_dot(inv_h, je)
+            dp = -batch_solve(
+                t.h_prior + np.matmul(np.matmul(jp, inv_h),
+                                      jp.transpose((0, 2, 1))),
+                t.j_prior * p - batch_dot(jp, dp))
+        else:
+            dp = batch_solve(h, je)
+            dp = batch_dot(jp, dp)
+
+        return dp
+
+    def solve_precomputed(self, dp, prior):
+        t = self.algorithm.transform
+        jp = t.jp()
+
+        if prior:
+            inv_h = self.algorithm._inv_h
+            dp = -np.linalg.solve(t.h_prior + jp.dot(inv_h.dot(jp.T)),
+                                  t.j_prior * t.as_vector() - jp.dot(dp))
+        else:
+            dp = jp.dot(dp)
+
+        return dp
+
+    def solve_precomputed_batch(self, dp, p, prior):
+        # dp: n_images x n_params
+        # p:  n_images x n_params
+        t = self.algorithm.transform
+        # jp depends on the state of the transform of every image
+        jp = np.empty((p.shape[0],) + (p.shape[1],) * 2)
+        for k, p_k in enumerate(p):
+            t.from_vector_inplace(p_k)
+            jp[k] = t.jp()
+
+        if prior:
+            inv_h = self.algorithm._inv_h
+            dp = -batch_solve(
+                t.h_prior + np.matmul(np.matmul(jp, inv_h),
+                                      jp.transpose((0, 2, 1))),
+                t.j_prior * p - batch_dot(jp, dp))
+        else:
+            dp = batch_dot(jp, dp)
+
+        return dp
+
 
 class PartsAAMInterface(AAMInterface):
 
@@ -330,6 +541,13 @@ class PartsAAMInterface(AAMInterface):
             parts_shape=self.algorithm.parts_shape,
             normalize_parts=self.algorithm.normalize_parts)
 
+    def warp_batch(self, images, targets):
+        # vectorized parts images: n_images x (n_parts x ... x w)
+        return np.array([build_parts_image(
+            image, target, parts_shape=self.algorithm.parts_shape,
+            normalize_parts=self.algorithm.normalize_parts).as_vector()
+            for image, target in zip(images, targets)])
+
     def gradient(self, image):
         g = fast_gradient(image.pixels.reshape(
             (-1,) + self.algorithm.appearance_model.mean().shape[-2:]))
@@ -364,3 +582,31 @@ class PartsAAMInterface(AAMInterface):
             dp = np.linalg.solve(h, j.T.dot(e))
 
         return dp
+
+    def solve_batch(self, h, je, p, prior):
+        j_prior = self.algorithm._j_prior
+
+        if prior:
+            dp = -batch_solve(np.diag(j_prior) + h, j_prior * p - je)
+        else:
+            dp = batch_solve(h, je)
+
+        return dp
+
+    def solve_precomputed(self, dp, prior):
+        a = self.algorithm
+
+        if prior:
+            # j^T e = h dp
+            dp = -a._inv_h_prior.dot(
+                a._j_prior * a.transform.as_vector() - a._h.dot(dp))
+
+        return dp
+
+    def solve_precomputed_batch(self, dp, p, prior):
+        a = self.algorithm
+
+        if prior:
+            dp = -(a._j_prior * p - dp.dot(a._h.T)).dot(a._inv_h_prior.T)
+
+        return dp
@@ -9,6 +9,8 @@ from menpo.transform import Translation
 
 from menpofast.image import MaskedImage
 
+from alabortcvpr2015.warp import piecewise_affine_warp, is_piecewise_affine
+
 
 # Abstract Interface for AAM Objects ------------------------------------------
 
@@ -133,11 +135,16 @@ class GlobalAAM(AAM):
         reference_frame = self._build_reference_frame(
             shape_instance, landmarks)
 
-        transform = self.transform(
-            reference_frame.landmarks['source'].lms, landmarks)
+        if is_piecewise_affine(self.transform):
+            pwa = piecewise_affine_warp(
+                reference_frame.mask, reference_frame.landmarks['source'].lms)
+            instance = pwa.warp(appearance_instance, landmarks)
+        else:
+            transform = self.transform(
+                reference_frame.landmarks['source'].lms, landmarks)
 
-        instance = appearance_instance.warp_to_mask(
-            reference_frame.mask, transform)
+            instance = appearance_instance.warp_to_mask(
+                reference_frame.mask, transform)
         instance.landmarks = reference_frame.landmarks
 
         return instance
@@ -3,10 +3,9 @@ import abc
 from copy import deepcopy
 import numpy as np
 
-from menpo.transform import Scale, Translation, GeneralizedProcrustesAnalysis
-from menpo.model import PCAModel
+from menpo.transform import Scale
 from menpo.shape import mean_pointcloud
-from menpo.visualize import print_dynamic, progress_bar_str
+from menpo.visualize import print_dynamic
 
 from menpofast.utils import build_parts_image, convert_from_menpo
 
@@ -14,6 +13,15 @@ from menpofit.transform.piecewiseaffine import DifferentiablePiecewiseAffine
 from menpofit.aam.builder import build_reference_frame
 
 from alabortcvpr2015.utils import fsmooth
+from alabortcvpr2015.parallel import map_images, imap_images
+from alabortcvpr2015.cache import cached
+from alabortcvpr2015.pyramid import ImagePyramid
+from alabortcvpr2015.storage import store_images
+from alabortcvpr2015.warp import piecewise_affine_warp, is_piecewise_affine
+from alabortcvpr2015.pca import build_pca_model, build_shape_model
+from alabortcvpr2015.instrument import measure
+from alabortcvpr2015.checkpoint import build_checkpoint
+from alabortcvpr2015.streaming import build_streaming
 
 
 # Abstract Interface for AAM Builders -----------------------------------------
@@ -21,12 +29,17 @@ from alabortcvpr2015.utils import fsmooth
 class AAMBuilder(object):
 
     def build(self, images, group=None, label=None, verbose=False):
+        # finished stages of a previous build are loaded from the checkpoint
+        checkpoint = build_checkpoint(self, images, group, label)
+        n_images = len(images)
         # compute reference shape
-        reference_shape = self._compute_reference_shape(images, group, label,
-                                                        verbose)
+        with measure(self.sink, 'reference_shape', n_items=n_images):
+            reference_shape = self._compute_reference_shape(
+                images, group, label, verbose)
         # normalize images
-        images = self._normalize_images(images, group, label, reference_shape,
-                                        verbose)
+        with measure(self.sink, 'normalization', n_items=n_images):
+            images = self._normalize_images(images, group, label,
+                                            reference_shape, verbose)
 
         # build models at each scale
         if verbose:
@@ -34,29 +47,40 @@ class AAMBuilder(object):
         shape_models = []
         appearance_models = []
         # for each pyramid level (high --> low)
-        for j, s in enumerate(self.scales):
+        for j in range(len(self.scales)):
             if verbose:
                 if len(self.scales) > 1:
                     level_str = '  - Level {}: '.format(j)
                 else:
                     level_str = '  - '
+            level_checkpoint = checkpoint.scoped('level_{}_'.format(j))
 
             # obtain image representation
             if j == 0:
                 # compute features at highest level
-                feature_images = self._compute_features(images, level_str,
-                                                        verbose)
-                level_images = feature_images
+                with measure(self.sink, 'features', level=j,
+                             n_items=n_images):
+                    level_images = self._compute_features(images, level_str,
+                                                          verbose)
+                if self.scale_features:
+                    # other levels are obtained from the features
+                    del images
             elif self.scale_features:
-                # scale features at other levels
-                level_images = self._scale_images(feature_images, s,
-                                                  level_str, verbose)
-            else:
-                # scale images and compute features at other levels
-                scaled_images = self._scale_images(images, s, level_str,
-                                                   verbose)
-                level_images = self._compute_features(scaled_images,
+                # scale features of the previous level
+                with measure(self.sink, 'scaling', level=j,
+                             n_items=n_images):
+                    level_images = self._scale_images(level_images, j,
                                                       level_str, verbose)
+            else:
+                # scale images of the previous level and compute features
+                with measure(self.sink, 'scaling', level=j,
+                             n_items=n_images):
+                    images = self._scale_images(images, j, level_str,
+                                                verbose)
+                with measure(self.sink, 'features', level=j,
+                             n_items=n_images):
+                    level_images = self._compute_features(images, level_str,
+                                                          verbose)
 
             # extract potentially rescaled shapes ath highest level
             level_shapes = [i.landmarks[group][label]
@@ -67,27 +91,41 @@ class AAMBuilder(object):
                 # obtain shape model
                 if verbose:
                     print_dynamic('{}Building shape model'.format(level_str))
-                shape_model = self._build_shape_model(
-                    level_shapes, self.max_shape_components)
+                with measure(self.sink, 'shape_model', level=j,
+                             n_items=n_images):
+                    shape_model = level_checkpoint.stage(
+                        'shape_model', self._build_shape_model, level_shapes,
+                        self.max_shape_components)
                 # add shape model to the list
                 shape_models.append(shape_model)
             else:
                 # copy precious shape model and add it to the list
                 shape_models.append(deepcopy(shape_model))
 
-            # obtain warped images
-            warped_images = self._warp_images(level_images, level_shapes,
-                                              shape_model.mean(), level_str,
-                                              verbose)
-
-            # obtain appearance model
-            if verbose:
-                print_dynamic('{}Building appearance model'.format(level_str))
-            appearance_model = PCAModel(warped_images)
-            # trim appearance model if required
-            if self.max_appearance_components is not None:
-                appearance_model.trim_components(
-                    self.max_appearance_components)
+            if 'appearance_model' in level_checkpoint:
+                appearance_model = level_checkpoint.load('appearance_model')
+            else:
+                # obtain warped images
+                with measure(self.sink, 'warping', level=j,
+                             n_items=n_images):
+                    warped_images = self._warp_images(
+                        level_images, level_shapes, shape_model.mean(),
+                        level_str, verbose)
+
+                # obtain appearance model
+                if verbose:
+                    print_dynamic('{}Building appearance model'.format(
+                        level_str))
+                with measure(self.sink, 'appearance_model', level=j,
+                             n_items=n_images):
+                    appearance_model = build_pca_model(
+                        warped_images, self.max_appearance_components,
+                        randomized=self.randomized_pca)
+                level_checkpoint.save('appearance_model', appearance_model)
+                del warped_images
+            if not self.scale_features:
+                # the next level is not obtained from this one
+                del level_images
             # add appearance model to the list
             appearance_models.append(appearance_model)
 
@@ -104,6 +142,46 @@ class AAMBuilder(object):
 
         return aam
 
+    def build_streaming(self, images, group=None, label=None, batch_size=32,
+                        verbose=False):
+        r"""
+        Builds the AAM in two passes over the images, so that only
+        ``batch_size`` images are in memory at any time and, if
+        ``max_appearance_components`` is an `int`, only that many appearance
+        components are kept between batches.
+
+        Parameters
+        ----------
+        images : `callable` or `iterable` of :map:`Image`
+            Either a callable returning a new iterator over the images, e.g.
+            ``lambda: mio.import_images(path)``, or an iterable that can be
+            iterated twice.
+        group : `str`, optional
+            The landmark group.
+        label : `str`, optional
+            The landmark label.
+        batch_size : `int`, optional
+            The number of images processed at once.
+        verbose : `bool`, optional
+            If ``True``, the progress is printed.
+
+        Returns
+        -------
+        aam : :map:`GlobalAAM` or :map:`PartsAAM`
+            The AAM.
+        """
+        reference_shape, shape_models, appearance_models, _ = build_streaming(
+            self, images, group, label, batch_size, verbose, appearance=True)
+
+        # reverse the list of shape and appearance models so that they are
+        # ordered from lower to higher resolution
+        shape_models.reverse()
+        appearance_models.reverse()
+        self.scales.reverse()
+
+        return self._build_aam(shape_models, appearance_models,
+                               reference_shape)
+
     def _compute_reference_shape(self, images, group, label, verbose):
         # the reference_shape is the mean shape of the images' landmarks
         if verbose:
@@ -119,43 +197,37 @@ class AAMBuilder(object):
 
     def _normalize_images(self, images, group, label, ref_shape, verbose):
         # normalize the scaling of all images wrt the reference_shape size
-        norm_images = []
-        for c, i in enumerate(images):
-            if verbose:
-                print_dynamic('- Normalizing images size: {}'.format(
-                    progress_bar_str((c + 1.) / len(images), show_bar=False)))
+        def normalize(i):
             i = i.rescale_to_reference_shape(ref_shape, group=group,
                                              label=label)
             if self.sigma:
                 i.pixels = fsmooth(i.pixels, self.sigma)
-            norm_images.append(i)
-        return norm_images
+            return i
 
-    def _compute_features(self, images, level_str, verbose):
-        feature_images = []
-        for c, i in enumerate(images):
-            if verbose:
-                print_dynamic(
-                    '{}Computing feature space: {}'.format(
-                        level_str, progress_bar_str((c + 1.) / len(images),
-                                                    show_bar=False)))
-            if self.features:
-                i = self.features(i)
-            feature_images.append(i)
+        normalize = cached(self.cache, normalize, 'normalize', ref_shape,
+                           group, label, self.sigma)
+        return map_images(normalize, images, n_jobs=self.n_jobs,
+                          verbose=verbose,
+                          prefix='- Normalizing images size: ')
 
-        return feature_images
+    def _pyramid(self):
+        return ImagePyramid(self.scales, features=self.features,
+                            scale_features=self.scale_features,
+                            cache=self.cache)
 
-    @classmethod
-    def _scale_images(cls, images, s, level_str, verbose):
-        scaled_images = []
-        for c, i in enumerate(images):
-            if verbose:
-                print_dynamic(
-                    '{}Scaling features: {}'.format(
-                        level_str, progress_bar_str((c + 1.) / len(images),
-                                                    show_bar=False)))
-            scaled_images.append(i.rescale(s))
-        return scaled_images
+    def _compute_features(self, images, level_str, verbose):
+        # without features the images are returned as they are
+        n_jobs = self.n_jobs if self.features else 1
+        return map_images(
+            self._pyramid().compute_features(), images, n_jobs=n_jobs,
+            verbose=verbose,
+            prefix='{}Computing feature space: '.format(level_str))
+
+    def _scale_images(self, images, level, level_str, verbose):
+        # images of level are obtained from the ones of the previous level
+        return map_images(self._pyramid().rescale(level), images,
+                          n_jobs=self.n_jobs, verbose=verbose,
+                          prefix='{}Scaling features: '.format(level_str))
 
     @classmethod
     def _build_shape_model(cls, shapes, max_components):
@@ -177,19 +249,7 @@ class AAMBuilder(object):
         shape_model: :class:`menpo.model.pca`
             The PCA shape model.
         """
-
-        # centralize shapes
-        centered_shapes = [Translation(-s.centre()).apply(s) for s in shapes]
-        # align centralized shape using Procrustes Analysis
-        gpa = GeneralizedProcrustesAnalysis(centered_shapes)
-        aligned_shapes = [s.aligned_source() for s in gpa.transforms]
-        # build shape model
-        shape_model = PCAModel(aligned_shapes)
-        if max_components is not None:
-            # trim shape model if required
-            shape_model.trim_components(max_components)
-
-        return shape_model
+        return build_shape_model(shapes, max_components)
 
     @abc.abstractmethod
     def _build_aam(self, shape_models, appearance_models, reference_shape):
@@ -204,7 +264,9 @@ class GlobalAAMBuilder(AAMBuilder):
                  trilist=None, diagonal=None, sigma=None, scales=(1, .5),
                  scale_shapes=True, scale_features=True,
                  max_shape_components=None, max_appearance_components=None,
-                 boundary=3):
+                 boundary=3, randomized_pca=False, n_jobs=1,
+                 cache=None, spill_dir=None, checkpoint_dir=None,
+                 sink=None):
 
         self.features = features
         self.transform = transform
@@ -217,6 +279,12 @@ class GlobalAAMBuilder(AAMBuilder):
         self.max_shape_components = max_shape_components
         self.max_appearance_components = max_appearance_components
         self.boundary = boundary
+        self.randomized_pca = randomized_pca
+        self.n_jobs = n_jobs
+        self.cache = cache
+        self.spill_dir = spill_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.sink = sink
 
     def _build_reference_frame(self, mean_shape):
         return convert_from_menpo(
@@ -226,22 +294,31 @@ class GlobalAAMBuilder(AAMBuilder):
     def _warp_images(self, images, shapes, ref_shape, level_str, verbose):
         # compute transforms
         ref_frame = self._build_reference_frame(ref_shape)
-        # warp images to reference frame
-        warped_images = []
-        for c, (i, s) in enumerate(zip(images, shapes)):
-            if verbose:
-                print_dynamic('{}Warping images - {}'.format(
-                    level_str,
-                    progress_bar_str(float(c + 1) / len(images),
-                                     show_bar=False)))
-            # compute transforms
-            t = self.transform(ref_frame.landmarks['source'].lms, s)
-            # warp images
-            warped_i = i.warp_to_mask(ref_frame.mask, t)
+        pwa = None
+        if is_piecewise_affine(self.transform):
+            # triangles and barycentric coordinates are computed once per
+            # reference frame
+            pwa = piecewise_affine_warp(ref_frame.mask,
+                                        ref_frame.landmarks['source'].lms)
+
+        def warp(args):
+            i, s = args
+            if pwa is not None:
+                warped_i = pwa.warp(i, s)
+            else:
+                # compute transforms
+                t = self.transform(ref_frame.landmarks['source'].lms, s)
+                # warp images
+                warped_i = i.warp_to_mask(ref_frame.mask, t)
             # attach reference frame landmarks to images
             warped_i.landmarks['source'] = ref_frame.landmarks['source']
-            warped_images.append(warped_i)
-        return warped_images
+            return warped_i
+
+        # warp images to reference frame
+        warped_images = imap_images(
+            warp, list(zip(images, shapes)), n_jobs=self.n_jobs,
+            verbose=verbose, prefix='{}Warping images - '.format(level_str))
+        return store_images(warped_images, len(images), self.spill_dir)
 
     def _build_aam(self, shape_models, appearance_models, reference_shape):
         return GlobalAAM(shape_models, appearance_models, reference_shape,
@@ -254,7 +331,10 @@ class PartsAAMBuilder(AAMBuilder):
     def __init__(self, parts_shape=(16, 16), features=None,
                  normalize_parts=False, diagonal=None, sigma=None,
                  scales=(1, .5), scale_shapes=True, scale_features=True,
-                 max_shape_components=None, max_appearance_components=None):
+                 max_shape_components=None, max_appearance_components=None,
+                 randomized_pca=False, n_jobs=1,
+                 cache=None, spill_dir=None, checkpoint_dir=None,
+                 sink=None):
 
         self.parts_shape = parts_shape
         self.features = features
@@ -266,22 +346,25 @@ class PartsAAMBuilder(AAMBuilder):
         self.scale_features = scale_features
         self.max_shape_components = max_shape_components
         self.max_appearance_components = max_appearance_components
+        self.randomized_pca = randomized_pca
+        self.n_jobs = n_jobs
+        self.cache = cache
+        self.spill_dir = spill_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.sink = sink
 
     def _warp_images(self, images, shapes, _, level_str, verbose):
 
         # extract parts
-        parts_images = []
-        for c, (i, s) in enumerate(zip(images, shapes)):
-            if verbose:
-                print_dynamic('{}Warping images - {}'.format(
-                    level_str,
-                    progress_bar_str(float(c + 1) / len(images),
-                                     show_bar=False)))
-            parts_image = build_parts_image(
+        def extract_parts(args):
+            i, s = args
+            return build_parts_image(
                 i, s, self.parts_shape, normalize_parts=self.normalize_parts)
-            parts_images.append(parts_image)
 
-        return parts_images
+        warped_images = imap_images(
+            extract_parts, list(zip(images, shapes)), n_jobs=self.n_jobs,
+            verbose=verbose, prefix='{}Warping images - '.format(level_str))
+        return store_images(warped_images, len(images), self.spill_dir)
 
     def _build_aam(self, shape_models, appearance_models, reference_shape):
         return PartsAAM(shape_models, appearance_models, reference_shape,
@@ -0,0 +1,139 @@
+from __future__ import division
+import numpy as np
+
+
+# Lockstep Fitting of Batches of Images ---------------------------------------
+
+class LockstepState(object):
+    r"""
+    State of a batch of images fitted in lockstep by a single algorithm.
+
+    The parameters of all images are the rows of one
+    ``(n_images, n_parameters)`` array, updated at once at every iteration.
+    The transform of the algorithm is only used to obtain the target of
+    every image from its parameters, hence a single transform serves the
+    whole batch. Images whose target moves less than ``eps`` are dropped
+    from the active set, so that later iterations only process the images
+    that did not converge yet.
+
+    Parameters
+    ----------
+    transform : :map:`OrthoMDTransform` or :map:`OrthoPDM`
+        The transform of the algorithm.
+    initial_shapes : `list` of :map:`PointCloud`
+        The initial shape of every image.
+    eps : `float`
+        The convergence threshold.
+    """
+    def __init__(self, transform, initial_shapes, eps):
+        self.transform = transform
+        self.eps = eps
+        self.shape_parameters = []
+        self.targets = []
+        for s in initial_shapes:
+            transform.set_target(s)
+            self.shape_parameters.append([transform.as_vector()])
+            self.targets.append(transform.target)
+        self.parameters = np.array([p[0] for p in self.shape_parameters])
+        self.active = np.arange(len(initial_shapes))
+
+    @property
+    def n_active(self):
+        r"""
+        The number of images that did not converge yet.
+
+        :type: `int`
+        """
+        return self.active.size
+
+    def active_targets(self):
+        r"""
+        Returns the current target of every active image.
+        """
+        return [self.targets[n] for n in self.active]
+
+    def active_parameters(self):
+        r"""
+        Returns the ``(n_active, n_parameters)`` parameters of the active
+        images.
+        """
+        return self.parameters[self.active]
+
+    def load(self, n):
+        r"""
+        Sets the transform to the current state of image ``n``.
+        """
+        self.transform.from_vector_inplace(self.parameters[n])
+
+    def update(self, dp):
+        r"""
+        Adds the ``(n_active, n_parameters)`` updates to the parameters of
+        the active images and drops the ones that converged.
+        """
+        converged = np.zeros(self.n_active, dtype=bool)
+        for k, n in enumerate(self.active):
+            target = self.targets[n]
+            self.transform.from_vector_inplace(self.parameters[n] + dp[k])
+            self.parameters[n] = self.transform.as_vector()
+            self.shape_parameters[n].append(self.parameters[n].copy())
+            self.targets[n] = self.transform.target
+            # test convergence
+            error = np.abs(np.linalg.norm(
+                target.points - self.targets[n].points))
+            converged[k] = error < self.eps
+        self.active = self.active[~converged]
+
+
+def batch_solve(a, b):
+    r"""
+    Solves ``a x = b`` for every row of ``b``, where ``a`` is either shared
+    by all rows, ``(n, n)``, or one per row, ``(n_rows, n, n)``.
+    """
+    if a.ndim == 2:
+        return np.linalg.solve(a, b.T).T
+    return np.linalg.solve(a, b[..., None])[..., 0]
+
+
+def batch_dot(a, b):
+    r"""
+    Returns ``a.dot(x)`` for every row ``x`` of ``b``, where ``a`` is either
+    shared by all rows, ``(m, n)``, or one per row, ``(n_rows, m, n)``.
+    """
+    if a.ndim == 2:
+        return b.dot(a.T)
+    return np.einsum('nij,nj->ni', a, b)
+
+
+def batch_results(result_cls, images, algorithm, state, gt_shapes=None,
+                  **kwargs):
+    r"""
+    Returns the algorithm result of every image of a batch fitted in
+    lockstep.
+
+    Parameters
+    ----------
+    result_cls : `type`
+        The class of the results, e.g. :map:`AAMAlgorithmResult`.
+    images : `list` of :map:`Image`
+        The images.
+    algorithm : `object`
+        The algorithm.
+    state : :map:`LockstepState`
+        The final state of the batch.
+    gt_shapes : `list` of :map:`PointCloud` or ``None``, optional
+        The ground truth shape of every image.
+    kwargs : `dict`
+        Further arguments of the results, given as a `list` with one value
+        per image.
+
+    Returns
+    -------
+    results : `list`
+        The result of every image.
+    """
+    if gt_shapes is None:
+        gt_shapes = [None] * len(images)
+    return [result_cls(image, algorithm, state.shape_parameters[n],
+                       gt_shape=gt_shapes[n],
+                       **dict((k, v[n]) for k, v in kwargs.items()))
+            for n, image in enumerate(images)]
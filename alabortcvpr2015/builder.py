@@ -0,0 +1,258 @@
+from __future__ import division
+from copy import deepcopy
+import numpy as np
+from scipy.stats import multivariate_normal
+
+from menpo.visualize import print_dynamic
+
+from menpofit.base import build_sampling_grid
+
+from alabortcvpr2015.pca import build_pca_model
+from alabortcvpr2015.instrument import measure
+from alabortcvpr2015.aam.builder import (AAMBuilder, GlobalAAMBuilder,
+                                         PartsAAMBuilder)
+from alabortcvpr2015.clm.builder import CLMBuilder, build_classifiers
+from alabortcvpr2015.unified.builder import (UnifiedBuilder,
+                                             GlobalUnifiedBuilder,
+                                             PartsUnifiedBuilder)
+
+
+# Combined Builder ------------------------------------------------------------
+
+class MultiBuilder(object):
+    r"""
+    Builds the models of several AAM, CLM and Unified builders in a single
+    pass, running every stage shared by some of them only once per pyramid
+    level:
+
+        - the reference shape, the normalization of the images, the feature
+          images and the shape models are shared by all builders;
+        - the warped images and the appearance models are shared by the
+          builders that warp (and trim) in the same way, e.g. a
+          :map:`GlobalAAMBuilder` and a :map:`GlobalUnifiedBuilder`;
+        - the parts images and the classifiers are shared by the builders
+          that extract and train them in the same way, e.g. a
+          :map:`CLMBuilder` and a :map:`GlobalUnifiedBuilder`.
+
+    Every model gets its own copy of the shared shape and appearance models
+    and classifiers, so that fitters can modify them independently.
+
+    Parameters
+    ----------
+    builders : `list` of :map:`AAMBuilder`, :map:`CLMBuilder` or
+    :map:`UnifiedBuilder`
+        The builders. They must share the same ``features``, ``diagonal``,
+        ``sigma``, ``scales``, ``scale_shapes``, ``scale_features`` and
+        ``max_shape_components``. The shared stages run with the
+        ``n_jobs``, ``cache`` and ``sink`` of the first builder.
+    """
+    # attributes of the stages shared by all builders
+    shared_attributes = ('features', 'diagonal', 'sigma', 'scales',
+                         'scale_shapes', 'scale_features',
+                         'max_shape_components')
+
+    def __init__(self, builders):
+        if len(builders) == 0:
+            raise ValueError('At least one builder is required')
+        for attr in self.shared_attributes:
+            values = [getattr(b, attr) for b in builders]
+            if any(v != values[0] for v in values[1:]):
+                raise ValueError('All builders must have the same '
+                                 '{}'.format(attr))
+        self.builders = builders
+
+    def build(self, images, group=None, label=None, verbose=False, **kwargs):
+        r"""
+        Builds the models of all builders.
+
+        Parameters
+        ----------
+        images : `list` of :map:`Image`
+            The training images.
+        group : `str`, optional
+            The landmark group.
+        label : `str`, optional
+            The landmark label.
+        verbose : `bool`, optional
+            If ``True``, the progress is printed.
+        kwargs : `dict`
+            Passed to the classifiers.
+
+        Returns
+        -------
+        models : `list`
+            The model of each builder, in the same order as the builders.
+        """
+        b = self.builders[0]
+        n_builders = len(self.builders)
+        n_images = len(images)
+
+        # compute reference shape
+        with measure(b.sink, 'reference_shape', n_items=n_images):
+            reference_shape = b._compute_reference_shape(images, group, label,
+                                                         verbose)
+        # normalize images
+        with measure(b.sink, 'normalization', n_items=n_images):
+            images = b._normalize_images(images, group, label,
+                                         reference_shape, verbose)
+
+        # build models at each scale
+        if verbose:
+            print_dynamic('- Building models\n')
+        shape_models = [[] for _ in range(n_builders)]
+        appearance_models = [[] for _ in range(n_builders)]
+        classifiers = [[] for _ in range(n_builders)]
+        # for each pyramid level (high --> low)
+        for j in range(len(b.scales)):
+            level_str = ''
+            if verbose:
+                if len(b.scales) > 1:
+                    level_str = '  - Level {}: '.format(j)
+                else:
+                    level_str = '  - '
+
+            # obtain image representation
+            if j == 0:
+                # compute features at highest level
+                with measure(b.sink, 'features', level=j, n_items=n_images):
+                    level_images = b._compute_features(images, level_str,
+                                                       verbose)
+            elif b.scale_features:
+                # scale features of the previous level
+                with measure(b.sink, 'scaling', level=j, n_items=n_images):
+                    level_images = b._scale_images(level_images, j,
+                                                   level_str, verbose)
+            else:
+                # scale images of the previous level and compute features
+                with measure(b.sink, 'scaling', level=j, n_items=n_images):
+                    images = b._scale_images(images, j, level_str, verbose)
+                with measure(b.sink, 'features', level=j, n_items=n_images):
+                    level_images = b._compute_features(images, level_str,
+                                                       verbose)
+
+            # extract potentially rescaled shapes ath highest level
+            level_shapes = [i.landmarks[group][label]
+                            for i in level_images]
+
+            # obtain shape representation
+            if j == 0 or b.scale_shapes:
+                # obtain shape model
+                if verbose:
+                    print_dynamic('{}Building shape model'.format(level_str))
+                with measure(b.sink, 'shape_model', level=j,
+                             n_items=n_images):
+                    shape_model = b._build_shape_model(
+                        level_shapes, b.max_shape_components)
+
+            # stages shared by some of the builders, by key
+            warped = {}
+            shared_appearance_models = {}
+            shared_classifiers = {}
+            for k, builder in enumerate(self.builders):
+                shape_models[k].append(deepcopy(shape_model))
+
+                if isinstance(builder, (AAMBuilder, UnifiedBuilder)):
+                    # obtain warped images
+                    key = _warp_key(builder)
+                    if key not in warped:
+                        with measure(b.sink, 'warping', level=j,
+                                     n_items=n_images):
+                            warped[key] = builder._warp_images(
+                                level_images, level_shapes,
+                                shape_model.mean(), level_str, verbose)
+                    warped_images = warped[key]
+
+                    # obtain appearance model
+                    key += (builder.max_appearance_components,
+                            builder.randomized_pca)
+                    if key not in shared_appearance_models:
+                        if verbose:
+                            print_dynamic('{}Building appearance '
+                                          'model'.format(level_str))
+                        with measure(b.sink, 'appearance_model', level=j,
+                                     n_items=n_images):
+                            shared_appearance_models[key] = build_pca_model(
+                                warped_images,
+                                builder.max_appearance_components,
+                                randomized=builder.randomized_pca)
+                    appearance_models[k].append(
+                        deepcopy(shared_appearance_models[key]))
+
+                if isinstance(builder, (CLMBuilder, UnifiedBuilder)):
+                    key = _classifier_key(builder)
+                    if key not in shared_classifiers:
+                        if isinstance(builder, PartsUnifiedBuilder):
+                            # parts images are warped images
+                            parts_images = warped_images
+                        else:
+                            with measure(b.sink, 'warping', level=j,
+                                         n_items=n_images):
+                                parts_images = builder._parts_images(
+                                    level_images, level_shapes, level_str,
+                                    verbose)
+                        # build desired responses
+                        mvn = multivariate_normal(mean=np.zeros(2),
+                                                  cov=builder.covariance)
+                        grid = build_sampling_grid(builder.parts_shape)
+                        Y = [mvn.pdf(grid + offset)
+                             for offset in builder.offsets]
+                        with measure(b.sink, 'classifiers', level=j,
+                                     n_items=n_images):
+                            shared_classifiers[key] = build_classifiers(
+                                builder.classifier, parts_images, n_images,
+                                Y, level_str, verbose, n_jobs=builder.n_jobs,
+                                sink=b.sink, level=j, **kwargs)
+                    classifiers[k].append(
+                        deepcopy(shared_classifiers[key]))
+
+            if verbose:
+                print_dynamic('{}Done\n'.format(level_str))
+
+        models = []
+        for k, builder in enumerate(self.builders):
+            # reverse the list of models so that they are ordered from lower
+            # to higher resolution
+            shape_models[k].reverse()
+            appearance_models[k].reverse()
+            classifiers[k].reverse()
+            builder.scales.reverse()
+
+            if isinstance(builder, AAMBuilder):
+                models.append(builder._build_aam(
+                    shape_models[k], appearance_models[k], reference_shape))
+            elif isinstance(builder, CLMBuilder):
+                models.append(builder._build_clm(
+                    shape_models[k], classifiers[k], reference_shape))
+            else:
+                models.append(builder._build_unified(
+                    shape_models[k], appearance_models[k], classifiers[k],
+                    reference_shape))
+
+        return models
+
+
+def _warp_key(builder):
+    if isinstance(builder, (GlobalAAMBuilder, GlobalUnifiedBuilder)):
+        return ('global', builder.transform, builder.boundary,
+                _array_key(builder.trilist))
+    elif isinstance(builder, (PartsAAMBuilder, PartsUnifiedBuilder)):
+        return ('parts', tuple(builder.parts_shape), builder.normalize_parts)
+    # unknown builders never share their warped images
+    return ('builder', id(builder))
+
+
+def _classifier_key(builder):
+    if isinstance(builder, PartsUnifiedBuilder):
+        parts_key = ('warped',) + _warp_key(builder)
+    else:
+        parts_key = ('parts', tuple(builder.parts_shape),
+                     _array_key(builder.offsets), builder.normalize_parts)
+    return parts_key + (builder.classifier, builder.covariance,
+                        _array_key(builder.offsets))
+
+
+def _array_key(a):
+    if a is None:
+        return None
+    a = np.asarray(a)
+    return a.shape, a.tobytes()
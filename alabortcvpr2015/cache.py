@@ -0,0 +1,363 @@
+from __future__ import division
+import os
+import re
+import copy
+import hashlib
+import tempfile
+import types
+import functools
+import numpy as np
+
+from .utils import pickle_load, pickle_dump
+
+
+# On-disk Cache of Images -----------------------------------------------------
+
+class ImageCache(object):
+    r"""
+    Persistent, content-addressed cache of processed images.
+
+    Every entry stores the pixels of an image as a ``.npy`` file, memory
+    mapped (copy-on-write) when read back, and the rest of the image
+    (landmarks, mask, ...) as a pickle. Entries are keyed by a hash of the
+    input image (pixels, mask and landmarks) and of the parameters of the
+    processing, including a fingerprint of the callables involved, see
+    :map:`fingerprint`.
+
+    Whenever the total size of the cache exceeds ``max_size``, the least
+    recently used entries are evicted. The size is kept in memory, from a
+    single scan of the directory when the cache is created, and the
+    directory is only scanned again when the limit is crossed, which also
+    accounts for the entries stored meanwhile by other processes.
+
+    Parameters
+    ----------
+    path : `str`
+        The directory of the cache. It is created if it does not exist.
+    max_size : `int` or ``None``, optional
+        The maximum size of the cache in bytes. If ``None``, the cache is
+        unbounded.
+    """
+    # size of the entries in bytes, as far as this object knows
+    _size = None
+
+    def __init__(self, path, max_size=None):
+        self.path = str(path)
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        if max_size is not None:
+            self._size = self._entries()[1]
+
+    def apply(self, function, image, *params):
+        r"""
+        Returns ``function(image)``, from the cache if available.
+
+        Parameters
+        ----------
+        function : `callable`
+            The processing, taking an image and returning an image.
+        image : :map:`Image`
+            The image.
+        params : `tuple`
+            Every parameter the result depends on other than the image.
+
+        Returns
+        -------
+        result : :map:`Image`
+            The processed image.
+        """
+        key = self.key(image, *params)
+        result = self.get(key)
+        if result is None:
+            result = function(image)
+            self.put(key, result)
+        return result
+
+    @classmethod
+    def key(cls, image, *params):
+        r"""
+        Returns the key of the result of processing ``image`` with
+        ``params``.
+
+        Returns
+        -------
+        key : `str`
+            The hexadecimal key.
+        """
+        h = hashlib.sha1()
+        _hash_update(h, image.pixels)
+        mask = getattr(image, 'mask', None)
+        if mask is not None:
+            _hash_update(h, mask.pixels)
+        for group in sorted(image.landmarks.keys()):
+            _hash_update(h, group)
+            _hash_update(h, image.landmarks[group].lms.points)
+        for p in params:
+            _hash_update(h, p)
+        return h.hexdigest()
+
+    def get(self, key):
+        r"""
+        Returns the image stored under ``key`` or ``None`` if there is none.
+        """
+        pixels_path, image_path = self._paths(key)
+        try:
+            image = pickle_load(image_path)
+            image.pixels = np.load(pixels_path, mmap_mode='c')
+        except (IOError, OSError, EOFError):
+            return None
+        # mark the entry as recently used
+        os.utime(image_path, None)
+        return image
+
+    def put(self, key, image):
+        r"""
+        Stores ``image`` under ``key`` and evicts the least recently used
+        entries if the cache is full.
+        """
+        pixels_path, image_path = self._paths(key)
+        image_without_pixels = copy.copy(image)
+        image_without_pixels.pixels = None
+        # write to temporary files first, so that concurrent readers never
+        # see partial entries
+        fd, tmp_pixels_path = tempfile.mkstemp(suffix='.npy', dir=self.path)
+        os.close(fd)
+        np.save(tmp_pixels_path, image.pixels)
+        fd, tmp_image_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        os.close(fd)
+        pickle_dump(image_without_pixels, tmp_image_path)
+        entry_size = (os.path.getsize(tmp_pixels_path) +
+                      os.path.getsize(tmp_image_path))
+        replaced_size = self._entry_size(pixels_path, image_path)
+        os.rename(tmp_pixels_path, pixels_path)
+        os.rename(tmp_image_path, image_path)
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = self._entries()[1]
+            else:
+                self._size += entry_size - replaced_size
+            if self._size > self.max_size:
+                self.evict(self.max_size)
+
+    def evict(self, max_size):
+        r"""
+        Removes the least recently used entries until the cache is not
+        larger than ``max_size`` bytes.
+        """
+        entries, size = self._entries()
+        for _, entry_size, pixels_path, image_path in sorted(entries):
+            if size <= max_size:
+                break
+            for path in (image_path, pixels_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        r"""
+        Removes all entries.
+        """
+        self.evict(0)
+
+    def _entries(self):
+        # (last use, size, pixels path, image path) of every entry and
+        # their total size
+        entries = []
+        size = 0
+        for name in os.listdir(self.path):
+            if not name.endswith('.pkl'):
+                continue
+            pixels_path, image_path = self._paths(name[:-4])
+            try:
+                entry_size = (os.path.getsize(pixels_path) +
+                              os.path.getsize(image_path))
+                entries.append((os.path.getmtime(image_path), entry_size,
+                                pixels_path, image_path))
+            except OSError:
+                # removed by a concurrent eviction
+                continue
+            size += entry_size
+        return entries, size
+
+    @classmethod
+    def _entry_size(cls, pixels_path, image_path):
+        try:
+            return os.path.getsize(pixels_path) + os.path.getsize(image_path)
+        except OSError:
+            return 0
+
+    def _paths(self, key):
+        path = os.path.join(self.path, key)
+        return path + '.npy', path + '.pkl'
+
+
+def cached(cache, function, *params):
+    r"""
+    Returns ``function`` looking its results up in ``cache`` first.
+
+    Parameters
+    ----------
+    cache : :map:`ImageCache` or ``None``
+        The cache. If ``None``, ``function`` is returned as it is.
+    function : `callable`
+        The processing, taking an image and returning an image.
+    params : `tuple`
+        Every parameter the result depends on other than the image.
+
+    Returns
+    -------
+    cached_function : `callable`
+        The cached processing.
+    """
+    if cache is None:
+        return function
+    return lambda image: cache.apply(function, image, *params)
+
+
+def fingerprint(function):
+    r"""
+    Returns a fingerprint of a callable that changes whenever its code,
+    default arguments, closure variables or the globals it refers to
+    change.
+
+    Globals that are modules, functions or classes are identified by their
+    qualified name, any other global by its value. Callables wrapping other
+    callables, e.g. through decorators, ``functools.partial``, bound methods
+    or callable instances, are fingerprinted recursively. The fingerprint
+    never depends on memory addresses, so it is the same in every session.
+
+    Parameters
+    ----------
+    function : `callable` or ``None``
+        The callable.
+
+    Returns
+    -------
+    fingerprint : `str`
+        The hexadecimal fingerprint.
+    """
+    h = hashlib.sha1()
+    _hash_callable(h, function)
+    return h.hexdigest()
+
+
+def _qualified_name(obj):
+    return '{}.{}'.format(getattr(obj, '__module__', None),
+                          getattr(obj, '__qualname__',
+                                  getattr(obj, '__name__', None)))
+
+
+def _code_names(code):
+    # the global (and attribute) names of a code object and of the code
+    # objects nested in it
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            names.update(_code_names(c))
+    return names
+
+
+def _hash_callable(h, function, seen=None):
+    # seen guards against objects referring to themselves
+    seen = set() if seen is None else seen
+    if id(function) in seen:
+        return
+    seen.add(id(function))
+    code = getattr(function, '__code__', None)
+    if code is not None:
+        h.update(_qualified_name(function).encode('utf-8'))
+        _hash_update(h, code, seen)
+        _hash_update(h, getattr(function, '__defaults__', None), seen)
+        _hash_update(h, getattr(function, '__kwdefaults__', None), seen)
+        for cell in getattr(function, '__closure__', None) or ():
+            _hash_update(h, cell.cell_contents, seen)
+        function_globals = getattr(function, '__globals__', {})
+        for name in sorted(_code_names(code)):
+            if name in function_globals:
+                h.update(name.encode('utf-8'))
+                _hash_global(h, function_globals[name], seen)
+    elif isinstance(function, functools.partial):
+        _hash_callable(h, function.func, seen)
+        _hash_update(h, function.args, seen)
+        _hash_update(h, function.keywords or {}, seen)
+    elif getattr(function, '__func__', None) is not None:
+        # bound methods
+        _hash_callable(h, function.__func__, seen)
+        _hash_update(h, function.__self__, seen)
+    elif isinstance(function, (type, types.BuiltinFunctionType)):
+        h.update(_qualified_name(function).encode('utf-8'))
+    elif function is None:
+        h.update(b'None')
+    else:
+        # callable instances
+        _hash_object(h, function, seen)
+        call = getattr(type(function), '__call__', None)
+        if getattr(call, '__code__', None) is not None:
+            _hash_callable(h, call, seen)
+
+
+def _hash_global(h, obj, seen):
+    if isinstance(obj, types.ModuleType):
+        h.update(obj.__name__.encode('utf-8'))
+    elif (isinstance(obj, (type, types.FunctionType,
+                           types.BuiltinFunctionType)) or
+            getattr(obj, '__code__', None) is not None):
+        h.update(_qualified_name(obj).encode('utf-8'))
+    else:
+        _hash_update(h, obj, seen)
+
+
+def _hash_object(h, obj, seen):
+    h.update(_qualified_name(type(obj)).encode('utf-8'))
+    state = getattr(obj, '__dict__', None)
+    if state is not None:
+        _hash_update(h, state, seen)
+    else:
+        _hash_repr(h, obj)
+
+
+# memory addresses in the representation of objects
+_address = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def _hash_repr(h, obj):
+    h.update(_address.sub('', repr(obj)).encode('utf-8'))
+
+
+def _hash_update(h, obj, seen=None):
+    seen = set() if seen is None else seen
+    if isinstance(obj, np.ndarray):
+        h.update(repr((obj.dtype.str, obj.shape)).encode('utf-8'))
+        h.update(np.ascontiguousarray(obj).data)
+    elif hasattr(obj, 'points'):
+        # shapes
+        _hash_update(h, obj.points)
+    elif isinstance(obj, (tuple, list)):
+        h.update(repr((type(obj).__name__, len(obj))).encode('utf-8'))
+        for o in obj:
+            _hash_update(h, o, seen)
+    elif isinstance(obj, dict):
+        h.update(repr(('dict', len(obj))).encode('utf-8'))
+        for k in sorted(obj, key=repr):
+            _hash_repr(h, k)
+            _hash_update(h, obj[k], seen)
+    elif isinstance(obj, types.CodeType):
+        # nested functions are constants of the enclosing code
+        h.update(obj.co_code)
+        _hash_update(h, obj.co_consts, seen)
+        _hash_update(h, obj.co_names, seen)
+    elif isinstance(obj, (type, types.ModuleType)):
+        _hash_global(h, obj, seen)
+    elif callable(obj):
+        _hash_callable(h, obj, seen)
+    elif getattr(obj, '__dict__', None) is not None:
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        _hash_object(h, obj, seen)
+    else:
+        _hash_repr(h, obj)
@@ -0,0 +1,129 @@
+from __future__ import division
+import os
+import copy
+import hashlib
+import tempfile
+
+from .utils import pickle_load, pickle_dump
+from .cache import ImageCache, _hash_update
+
+
+# Checkpoints of Resumable Computations ---------------------------------------
+
+class Checkpoint(object):
+    r"""
+    Directory storing the result of every finished stage of a long
+    computation, e.g. a build, so that a rerun of the same computation
+    resumes where the previous one stopped.
+
+    Results are pickled into ``path/key/name.pkl``, where ``key`` is a hash
+    of everything the computation depends on, so that a computation with a
+    different configuration never reuses them.
+
+    Parameters
+    ----------
+    path : `str` or ``None``
+        The directory. If ``None``, nothing is stored and every stage is
+        computed.
+    config : `tuple`
+        Everything the results depend on, hashed as :map:`ImageCache`
+        parameters.
+    """
+    def __init__(self, path, *config):
+        self.prefix = ''
+        self.path = None
+        if path is not None:
+            h = hashlib.sha1()
+            for c in config:
+                _hash_update(h, c)
+            self.path = os.path.join(str(path), h.hexdigest())
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+
+    def scoped(self, prefix):
+        r"""
+        Returns a view of this checkpoint whose names are prefixed with
+        ``prefix``, e.g. to store the stages of a pyramid level.
+        """
+        checkpoint = copy.copy(self)
+        checkpoint.prefix = self.prefix + prefix
+        return checkpoint
+
+    def __contains__(self, name):
+        return (self.path is not None and
+                os.path.isfile(self._path(name)))
+
+    def load(self, name):
+        r"""
+        Returns the result of the stage ``name``.
+        """
+        return pickle_load(self._path(name))
+
+    def save(self, name, result):
+        r"""
+        Stores the result of the stage ``name``.
+        """
+        if self.path is None:
+            return
+        # write to a temporary file first, so that an interrupted save never
+        # leaves a partial result
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        os.close(fd)
+        pickle_dump(result, tmp_path)
+        os.rename(tmp_path, self._path(name))
+
+    def stage(self, name, function, *args, **kwargs):
+        r"""
+        Returns the result of the stage ``name``, loaded if it was stored
+        or computed as ``function(*args, **kwargs)`` and stored otherwise.
+        """
+        if name in self:
+            return self.load(name)
+        result = function(*args, **kwargs)
+        self.save(name, result)
+        return result
+
+    def _path(self, name):
+        return os.path.join(self.path, self.prefix + name + '.pkl')
+
+
+# attributes of the builders that do not change the models they build
+_runtime_attributes = ('n_jobs', 'cache', 'spill_dir', 'checkpoint_dir',
+                       'sink')
+
+
+def build_checkpoint(builder, images, group, label, **kwargs):
+    r"""
+    Returns the :map:`Checkpoint` of a build, stored in the
+    ``checkpoint_dir`` of the builder.
+
+    The checkpoint depends on the class and the attributes of the builder,
+    except the ones only affecting how the build runs, e.g. ``n_jobs``, on
+    the images (pixels, masks and landmarks) and on the remaining
+    arguments of the build.
+
+    Parameters
+    ----------
+    builder : :map:`AAMBuilder`, :map:`CLMBuilder` or :map:`UnifiedBuilder`
+        The builder.
+    images : `list` of :map:`Image`
+        The training images.
+    group : `str`
+        The landmark group.
+    label : `str`
+        The landmark label.
+    kwargs : `dict`
+        Passed to the classifiers.
+
+    Returns
+    -------
+    checkpoint : :map:`Checkpoint`
+        The checkpoint.
+    """
+    if builder.checkpoint_dir is None:
+        return Checkpoint(None)
+    attributes = sorted((k, v) for k, v in builder.__dict__.items()
+                        if k not in _runtime_attributes)
+    return Checkpoint(builder.checkpoint_dir, type(builder).__name__,
+                      attributes, [ImageCache.key(i) for i in images],
+                      group, label, sorted(kwargs.items()))
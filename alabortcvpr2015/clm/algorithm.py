@@ -11,6 +11,7 @@ from menpofast.image import Image
 from menpofit.base import build_sampling_grid
 
 from alabortcvpr2015.aam.algorithm import PartsAAMInterface
+from alabortcvpr2015.batch import LockstepState, batch_results
 
 from .result import CLMAlgorithmResult
 
@@ -30,6 +31,11 @@ class CLMAlgorithm(object):
     def run(self, image, initial_shape, max_iters=20, gt_shape=None, **kwargs):
         pass
 
+    @abc.abstractmethod
+    def run_batch(self, images, initial_shapes, max_iters=20, gt_shapes=None,
+                  **kwargs):
+        pass
+
 
 class RLMS(CLMAlgorithm):
     r"""
@@ -156,3 +162,67 @@ class RLMS(CLMAlgorithm):
         # return algorithm result
         return CLMAlgorithmResult(image, self, shape_parameters,
                                   gt_shape=gt_shape)
+
+    def run_batch(self, images, initial_shapes, gt_shapes=None, max_iters=20,
+                  prior=False):
+        r"""
+        Fits several images in lockstep, see :map:`LockstepState`. The
+        responses of all images are computed at once and the results are
+        the same as the ones of :meth:`run` on every image.
+        """
+        state = LockstepState(self.transform, initial_shapes, self.eps)
+
+        for _ in xrange(max_iters):
+            if state.n_active == 0:
+                break
+
+            targets = state.active_targets()
+            # points: n_active x n_parts x n_dims
+            points = np.array([t.points for t in targets])
+            # get all (x, y) pairs being considered
+            xys = points[:, :, None, None, ...] + self._sampling_grid
+
+            diff = np.require(
+                np.round((np.round(points) - points) * self.factor),
+                dtype=int)
+
+            offsets = diff[:, :, None, None, :] + self.offset
+            kernel_grids = self._kernel_grid[offsets[..., 0],
+                                             offsets[..., 1]]
+
+            # build parts images
+            parts_pixels = np.array([build_parts_image(
+                images[n], t, parts_shape=self.parts_shape,
+                normalize_parts=self.normalize_parts).pixels
+                for n, t in zip(state.active, targets)])
+
+            # compute parts responses
+            parts_response = self.multiple_clf(parts_pixels)
+            parts_response[np.logical_not(np.isfinite(parts_response))] = .5
+
+            # compute parts kernels
+            parts_kernel = parts_response * kernel_grids
+            parts_kernel /= np.sum(
+                parts_kernel, axis=(-2, -1))[..., None, None]
+
+            # compute mean shift targets
+            mean_shift_target = np.sum(parts_kernel[..., None] * xys,
+                                       axis=(-3, -2))
+
+            # compute (shape) error terms
+            e = (mean_shift_target.reshape((state.n_active, -1)) -
+                 points.reshape((state.n_active, -1)))
+
+            # compute gauss-newton parameter updates
+            if prior:
+                dp = -(self._j_prior * state.active_parameters() -
+                       e.dot(self._j)).dot(self._inv_h_prior.T)
+            else:
+                dp = e.dot(self._pinv_jT.T)
+
+            # update pdms and test convergence
+            state.update(dp)
+
+        # return algorithm results
+        return batch_results(CLMAlgorithmResult, images, self, state,
+                             gt_shapes)
@@ -1,10 +1,10 @@
 from __future__ import division
 from copy import deepcopy
+from itertools import chain
 import numpy as np
 from scipy.stats import multivariate_normal
 
-from menpo.transform import Scale, Translation, GeneralizedProcrustesAnalysis
-from menpo.model import PCAModel
+from menpo.transform import Scale
 from menpo.shape import mean_pointcloud
 from menpo.visualize import print_dynamic, progress_bar_str
 
@@ -13,8 +13,17 @@ from menpofast.utils import build_parts_image
 from menpofit.base import build_sampling_grid
 
 from alabortcvpr2015.utils import fsmooth
+from alabortcvpr2015.parallel import map_images, imap_images
+from alabortcvpr2015.cache import cached
+from alabortcvpr2015.pyramid import ImagePyramid
+from alabortcvpr2015.storage import MemmapImages, store_images
+from alabortcvpr2015.parallel import thread_pool, imap
+from alabortcvpr2015.instrument import measure
+from alabortcvpr2015.checkpoint import Checkpoint, build_checkpoint
+from alabortcvpr2015.pca import build_shape_model
 
-from .classifier import MCF, MultipleMCF, LinearSVMLR, MultipleLinearSVMLR
+from .classifier import (MCF, IncrementalMCF, MultipleMCF, LinearSVMLR,
+                         MultipleLinearSVMLR)
 
 
 class CLMBuilder(object):
@@ -23,7 +32,9 @@ class CLMBuilder(object):
                  offsets=np.array([[0, 0]]), features=None,
                  normalize_parts=False, covariance=2, diagonal=None,
                  sigma=None, scales=(1, .5), scale_shapes=True,
-                 scale_features=True, max_shape_components=None):
+                 scale_features=True, max_shape_components=None, n_jobs=1,
+                 cache=None, spill_dir=None, checkpoint_dir=None,
+                 sink=None):
 
         self.classifier = classifier
         self.parts_shape = parts_shape
@@ -37,14 +48,24 @@ class CLMBuilder(object):
         self.scale_shapes = scale_shapes
         self.scale_features = scale_features
         self.max_shape_components = max_shape_components
+        self.n_jobs = n_jobs
+        self.cache = cache
+        self.spill_dir = spill_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.sink = sink
 
     def build(self, images, group=None, label=None, verbose=False, **kwargs):
+        # finished stages of a previous build are loaded from the checkpoint
+        checkpoint = build_checkpoint(self, images, group, label, **kwargs)
+        n_images = len(images)
         # compute reference shape
-        reference_shape = self._compute_reference_shape(images, group, label,
-                                                        verbose)
+        with measure(self.sink, 'reference_shape', n_items=n_images):
+            reference_shape = self._compute_reference_shape(
+                images, group, label, verbose)
         # normalize images
-        images = self._normalize_images(images, group, label, reference_shape,
-                                        verbose)
+        with measure(self.sink, 'normalization', n_items=n_images):
+            images = self._normalize_images(images, group, label,
+                                            reference_shape, verbose)
 
         # build models at each scale
         if verbose:
@@ -52,29 +73,40 @@ class CLMBuilder(object):
         shape_models = []
         classifiers = []
         # for each pyramid level (high --> low)
-        for j, s in enumerate(self.scales):
+        for j in range(len(self.scales)):
             if verbose:
                 if len(self.scales) > 1:
                     level_str = '  - Level {}: '.format(j)
                 else:
                     level_str = '  - '
+            level_checkpoint = checkpoint.scoped('level_{}_'.format(j))
 
             # obtain image representation
             if j == 0:
                 # compute features at highest level
-                feature_images = self._compute_features(images, level_str,
-                                                        verbose)
-                level_images = feature_images
+                with measure(self.sink, 'features', level=j,
+                             n_items=n_images):
+                    level_images = self._compute_features(images, level_str,
+                                                          verbose)
+                if self.scale_features:
+                    # other levels are obtained from the features
+                    del images
             elif self.scale_features:
-                # scale features at other levels
-                level_images = self._scale_images(feature_images, s,
-                                                  level_str, verbose)
-            else:
-                # scale images and compute features at other levels
-                scaled_images = self._scale_images(images, s, level_str,
-                                                   verbose)
-                level_images = self._compute_features(scaled_images,
+                # scale features of the previous level
+                with measure(self.sink, 'scaling', level=j,
+                             n_items=n_images):
+                    level_images = self._scale_images(level_images, j,
                                                       level_str, verbose)
+            else:
+                # scale images of the previous level and compute features
+                with measure(self.sink, 'scaling', level=j,
+                             n_items=n_images):
+                    images = self._scale_images(images, j, level_str,
+                                                verbose)
+                with measure(self.sink, 'features', level=j,
+                             n_items=n_images):
+                    level_images = self._compute_features(images, level_str,
+                                                          verbose)
 
             # extract potentially rescaled shapes ath highest level
             level_shapes = [i.landmarks[group][label]
@@ -85,43 +117,46 @@ class CLMBuilder(object):
                 # obtain shape model
                 if verbose:
                     print_dynamic('{}Building shape model'.format(level_str))
-                shape_model = self._build_shape_model(
-                    level_shapes, self.max_shape_components)
+                with measure(self.sink, 'shape_model', level=j,
+                             n_items=n_images):
+                    shape_model = level_checkpoint.stage(
+                        'shape_model', self._build_shape_model, level_shapes,
+                        self.max_shape_components)
                 # add shape model to the list
                 shape_models.append(shape_model)
             else:
                 # copy precious shape model and add it to the list
                 shape_models.append(deepcopy(shape_model))
 
-            # obtain parts images
-            parts_images = self._parts_images(level_images, level_shapes,
-                                              level_str, verbose)
-
-            # build desired responses
-            mvn = multivariate_normal(mean=np.zeros(2), cov=self.covariance)
-            grid = build_sampling_grid(self.parts_shape)
-            Y = [mvn.pdf(grid + offset) for offset in self.offsets]
-
-            # build classifiers
-            n_landmarks = level_shapes[0].n_points
-            level_classifiers = []
-            for l in range(n_landmarks):
-                if verbose:
-                    print_dynamic('{}Building classifiers - {}'.format(
-                        level_str,
-                        progress_bar_str((l + 1.) / n_landmarks,
-                                         show_bar=False)))
-
-                X = [i.pixels[l] for i in parts_images]
-
-                clf = self.classifier(X, Y, **kwargs)
-                level_classifiers.append(clf)
-
-            # build Multiple classifier
-            if self.classifier is MCF:
-                multiple_clf = MultipleMCF(level_classifiers)
-            elif self.classifier is LinearSVMLR:
-                multiple_clf = MultipleLinearSVMLR(level_classifiers)
+            if 'classifiers' in level_checkpoint:
+                multiple_clf = level_checkpoint.load('classifiers')
+            else:
+                # obtain parts images, lazily so that they can be consumed
+                # one at a time by the classifiers
+                with measure(self.sink, 'warping', level=j,
+                             n_items=n_images):
+                    parts_images = self._parts_images(
+                        level_images, level_shapes, level_str, verbose)
+
+                # build desired responses
+                mvn = multivariate_normal(mean=np.zeros(2),
+                                          cov=self.covariance)
+                grid = build_sampling_grid(self.parts_shape)
+                Y = [mvn.pdf(grid + offset) for offset in self.offsets]
+
+                # build classifiers
+                with measure(self.sink, 'classifiers', level=j,
+                             n_items=n_images):
+                    multiple_clf = build_classifiers(
+                        self.classifier, parts_images, n_images, Y,
+                        level_str, verbose, n_jobs=self.n_jobs,
+                        checkpoint=level_checkpoint, sink=self.sink, level=j,
+                        **kwargs)
+                level_checkpoint.save('classifiers', multiple_clf)
+                del parts_images
+            if not self.scale_features:
+                # the next level is not obtained from this one
+                del level_images
 
             # add appearance model to the list
             classifiers.append(multiple_clf)
@@ -135,12 +170,48 @@ class CLMBuilder(object):
         classifiers.reverse()
         self.scales.reverse()
 
-        clm = CLM(shape_models, classifiers, reference_shape,
-                  self.parts_shape, self.features, self.normalize_parts,
-                  self.covariance, self.sigma, self.scales, self.scale_shapes,
-                  self.scale_features)
+        return self._build_clm(shape_models, classifiers, reference_shape)
+
+    def build_streaming(self, images, group=None, label=None, batch_size=32,
+                        verbose=False, **kwargs):
+        r"""
+        Builds the CLM in two passes over the images, so that only
+        ``batch_size`` images are in memory at any time. Only :map:`MCF`
+        classifiers are supported.
 
-        return clm
+        Parameters
+        ----------
+        images : `callable` or `iterable` of :map:`Image`
+            Either a callable returning a new iterator over the images, e.g.
+            ``lambda: mio.import_images(path)``, or an iterable that can be
+            iterated twice.
+        group : `str`, optional
+            The landmark group.
+        label : `str`, optional
+            The landmark label.
+        batch_size : `int`, optional
+            The number of images processed at once.
+        verbose : `bool`, optional
+            If ``True``, the progress is printed.
+        kwargs : `dict`
+            Passed to the classifiers.
+
+        Returns
+        -------
+        clm : :map:`CLM`
+            The CLM.
+        """
+        reference_shape, shape_models, _, classifiers = build_streaming(
+            self, images, group, label, batch_size, verbose,
+            classifiers=True, **kwargs)
+
+        # reverse the list of shape models and classifiers so that they are
+        # ordered from lower to higher resolution
+        shape_models.reverse()
+        classifiers.reverse()
+        self.scales.reverse()
+
+        return self._build_clm(shape_models, classifiers, reference_shape)
 
     def _compute_reference_shape(self, images, group, label, verbose):
         # the reference_shape is the mean shape of the images' landmarks
@@ -157,45 +228,37 @@ class CLMBuilder(object):
 
     def _normalize_images(self, images, group, label, ref_shape, verbose):
         # normalize the scaling of all images wrt the reference_shape size
-        norm_images = []
-        for c, i in enumerate(images):
-            if verbose:
-                print_dynamic('- Normalizing images size: {}'.format(
-                    progress_bar_str((c + 1.) / len(images), show_bar=False)))
+        def normalize(i):
             i = i.rescale_to_reference_shape(ref_shape, group=group,
                                              label=label)
             if self.sigma:
                 i.pixels = fsmooth(i.pixels, self.sigma)
-            norm_images.append(i)
-        return norm_images
+            return i
 
-    def _compute_features(self, images, level_str, verbose):
-        feature_images = []
-        for c, i in enumerate(images):
-            if verbose:
-                print_dynamic(
-                    '{}Computing feature space: {}'.format(
-                        level_str,
-                        progress_bar_str((c + 1.) / len(images),
-                                         show_bar=False)))
-            if self.features:
-                i = self.features(i)
-            feature_images.append(i)
+        normalize = cached(self.cache, normalize, 'normalize', ref_shape,
+                           group, label, self.sigma)
+        return map_images(normalize, images, n_jobs=self.n_jobs,
+                          verbose=verbose,
+                          prefix='- Normalizing images size: ')
 
-        return feature_images
+    def _pyramid(self):
+        return ImagePyramid(self.scales, features=self.features,
+                            scale_features=self.scale_features,
+                            cache=self.cache)
 
-    @classmethod
-    def _scale_images(cls, images, s, level_str, verbose):
-        scaled_images = []
-        for c, i in enumerate(images):
-            if verbose:
-                print_dynamic(
-                    '{}Scaling features: {}'.format(
-                        level_str,
-                        progress_bar_str((c + 1.) / len(images),
-                                         show_bar=False)))
-            scaled_images.append(i.rescale(s))
-        return scaled_images
+    def _compute_features(self, images, level_str, verbose):
+        # without features the images are returned as they are
+        n_jobs = self.n_jobs if self.features else 1
+        return map_images(
+            self._pyramid().compute_features(), images, n_jobs=n_jobs,
+            verbose=verbose,
+            prefix='{}Computing feature space: '.format(level_str))
+
+    def _scale_images(self, images, level, level_str, verbose):
+        # images of level are obtained from the ones of the previous level
+        return map_images(self._pyramid().rescale(level), images,
+                          n_jobs=self.n_jobs, verbose=verbose,
+                          prefix='{}Scaling features: '.format(level_str))
 
     @classmethod
     def _build_shape_model(cls, shapes, max_components):
@@ -217,36 +280,149 @@ class CLMBuilder(object):
         shape_model: :class:`menpo.model.pca`
             The PCA shape model.
         """
-
-        # centralize shapes
-        centered_shapes = [Translation(-s.centre()).apply(s) for s in shapes]
-        # align centralized shape using Procrustes Analysis
-        gpa = GeneralizedProcrustesAnalysis(centered_shapes)
-        aligned_shapes = [s.aligned_source() for s in gpa.transforms]
-        # build shape model
-        shape_model = PCAModel(aligned_shapes)
-        if max_components is not None:
-            # trim shape model if required
-            shape_model.trim_components(max_components)
-
-        return shape_model
+        return build_shape_model(shapes, max_components)
 
     def _parts_images(self, images, shapes, level_str, verbose):
 
-        # extract parts
-        parts_images = []
-        for c, (i, s) in enumerate(zip(images, shapes)):
+        # extract parts, lazily
+        def extract_parts(args):
+            i, s = args
+            return build_parts_image(
+                i, s, self.parts_shape, offsets=self.offsets,
+                normalize_parts=self.normalize_parts)
+
+        parts_images = imap_images(
+            extract_parts, list(zip(images, shapes)), n_jobs=self.n_jobs,
+            verbose=verbose, prefix='{}Warping images - '.format(level_str))
+        if self.spill_dir is None:
+            return parts_images
+        return store_images(parts_images, len(images), self.spill_dir)
+
+    def _build_clm(self, shape_models, classifiers, reference_shape):
+        return CLM(shape_models, classifiers, reference_shape,
+                   self.parts_shape, self.features, self.normalize_parts,
+                   self.covariance, self.sigma, self.scales, self.scale_shapes,
+                   self.scale_features)
+
+
+def build_classifiers(classifier, parts_images, n_images, Y, level_str,
+                      verbose, n_jobs=1, checkpoint=None, sink=None,
+                      level=None, **kwargs):
+    r"""
+    Builds one classifier per landmark and combines them into a multiple
+    classifier.
+
+    Whenever the classifiers are :map:`MCF` whose per-frequency systems are
+    solved in the channel space, the parts images are consumed one at a
+    time and folded into an :map:`IncrementalMCF` per landmark, so that
+    they never need to be in memory at the same time. Otherwise, parts
+    images stored as :map:`MemmapImages` are read one landmark at a time.
+
+    Parameters
+    ----------
+    classifier : :map:`MCF` or :map:`LinearSVMLR`
+        The classifier class.
+    parts_images : `iterable` of :map:`Image` or :map:`MemmapImages`
+        The parts images from which the classifiers are trained.
+    n_images : `int`
+        The number of parts images.
+    Y : `list` of ``(height, width)`` `ndarray`
+        The desired response associated to each offset.
+    n_jobs : `int` or ``None``, optional
+        The number of threads among which the landmarks are split. The
+        classifiers are the same as the ones built serially.
+    checkpoint : :map:`Checkpoint` or ``None``, optional
+        If not ``None``, every classifier is stored as soon as it is
+        trained and the classifiers stored by a previous build are loaded
+        rather than trained.
+    sink : :map:`MemorySink`, :map:`JSONLSink` or ``None``, optional
+        If not ``None``, the training of every classifier is measured, see
+        :map:`measure`.
+    level : `int` or ``None``, optional
+        The pyramid level, added to the events emitted to ``sink``.
+
+    Returns
+    -------
+    multiple_clf : :map:`MultipleMCF` or :map:`MultipleLinearSVMLR`
+        The multiple classifier.
+    """
+    stored_images = (parts_images if isinstance(parts_images, MemmapImages)
+                     else None)
+    parts_images = iter(parts_images)
+    parts_image = next(parts_images)
+    n_landmarks, n_offsets, n_channels = parts_image.pixels.shape[:3]
+
+    if checkpoint is None:
+        checkpoint = Checkpoint(None)
+    names = ['classifier_{}'.format(l) for l in range(n_landmarks)]
+
+    pool = thread_pool(n_jobs)
+    try:
+        if classifier is MCF and n_channels <= n_images * n_offsets:
+            # accumulate the statistics of the classifiers that were not
+            # stored yet image by image
+            missing = [l for l in range(n_landmarks)
+                       if names[l] not in checkpoint]
+            incremental_classifiers = dict(
+                (l, IncrementalMCF(Y, **kwargs)) for l in missing)
+            if missing:
+                with measure(sink, 'classifier_statistics', level=level,
+                             n_items=n_images, n_landmarks=len(missing)):
+                    for parts_image in chain([parts_image], parts_images):
+                        for _ in imap(pool, _increment,
+                                      [(incremental_classifiers[l],
+                                        parts_image.pixels[l])
+                                       for l in missing]):
+                            pass
+
+            def train(l):
+                return checkpoint.stage(
+                    names[l], lambda: incremental_classifiers[l].finalize())
+        elif stored_images is not None:
+            # read the parts of one landmark at a time from the memmap
+            pixels = stored_images.vectors.reshape(
+                (n_images,) + parts_image.pixels.shape)
+
+            def train(l):
+                return checkpoint.stage(
+                    names[l], lambda: classifier(pixels[:, l], Y, **kwargs))
+        else:
+            parts_images = [parts_image] + list(parts_images)
+
+            def train(l):
+                return checkpoint.stage(
+                    names[l], lambda: classifier(
+                        [i.pixels[l] for i in parts_images], Y, **kwargs))
+
+        def measured_train(l):
+            with measure(sink, 'classifier', level=level, landmark=l,
+                         n_items=n_images):
+                return train(l)
+
+        trained_classifiers = imap(pool, measured_train, range(n_landmarks))
+
+        level_classifiers = []
+        for l, clf in enumerate(trained_classifiers):
             if verbose:
-                print_dynamic('{}Warping images - {}'.format(
+                print_dynamic('{}Building classifiers - {}'.format(
                     level_str,
-                    progress_bar_str(float(c + 1) / len(images),
+                    progress_bar_str((l + 1.) / n_landmarks,
                                      show_bar=False)))
-            parts_image = build_parts_image(
-                i, s, self.parts_shape, offsets=self.offsets,
-                normalize_parts=self.normalize_parts)
-            parts_images.append(parts_image)
+            level_classifiers.append(clf)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    # build Multiple classifier
+    if classifier is MCF:
+        return MultipleMCF(level_classifiers)
+    elif classifier is LinearSVMLR:
+        return MultipleLinearSVMLR(level_classifiers)
+
 
-        return parts_images
+def _increment(args):
+    clf, x = args
+    clf.increment(x)
 
 
 from .base import CLM
@@ -1,13 +1,20 @@
 from __future__ import division
 import numpy as np
-from numpy.fft import fft2, ifft2, fftshift
+from numpy.fft import fftshift
+from numpy.lib.stride_tricks import as_strided
+from scipy.special import expit
 from sklearn import svm
 from sklearn import linear_model
 
+from .fourier import get_fft_backend
+
 
 class MCF(object):
     r"""
     Multi-channel Correlation Filter
+
+    All inputs are real, hence only the non-redundant half of the spectrum
+    of the filter (as returned by ``rfft2``) is stored.
     """
     def __init__(self, X, Y, l=0, cosine_mask=False):
 
@@ -16,76 +23,322 @@ class MCF(object):
 
         n_offsets, n_channels, height, width = X[0].shape
 
-        self._cosine_mask = 1
+        self._spatial_shape = (height, width)
+        self._cosine_mask = self._build_cosine_mask(height, width,
+                                                    cosine_mask)
+
+        # compute the fft2 of all samples and desired responses at once
+        X_hat, Y_hat = self._flat_fft2s(X, Y)
+
+        # solve all per-frequency systems at once, in the sample space
+        # whenever it is smaller than the channel space
+        if X_hat.shape[1] < n_channels:
+            f = self._solve_dual(X_hat, Y_hat, l)
+        else:
+            H_hat, J_hat = self._compute_statistics(X_hat, Y_hat)
+            f = self._solve_primal(H_hat, J_hat, l)
+        self.f = np.require(f.T.reshape((n_channels, height, -1)),
+                            dtype=np.complex64, requirements=['C'])
+
+    def __call__(self, x):
+        fft = get_fft_backend()
+        x_hat = fft.rfft2(np.require(self._cosine_mask * x,
+                                     dtype=np.float32))
+        return fft.irfft2(self.f * x_hat, s=self._spatial_shape)
+
+    def __setstate__(self, state):
+        _half_spectrum_state(state, 'f')
+        self.__dict__.update(state)
+
+    @classmethod
+    def _build_cosine_mask(cls, height, width, cosine_mask):
         if cosine_mask:
             c1 = np.cos(np.linspace(-np.pi/2, np.pi/2, height))
             c2 = np.cos(np.linspace(-np.pi/2, np.pi/2, width))
-            self._cosine_mask = c1[..., None].dot(c2[None, ...])
-
-
-        X_hat = []
-        for x in X:
-            x_hat = np.require(fft2(self._cosine_mask * x),
-                               dtype=np.complex64)
-            X_hat.append(x_hat)
-
-        Y_hat = []
-        for y in Y:
-            y_hat = np.require(fft2(y),
-                               dtype=np.complex64)
-            Y_hat.append(y_hat)
-
-        self.f = np.zeros((n_channels, height, width), dtype=np.complex64)
-        for j in xrange(height):
-            for k in xrange(width):
-                H_hat = np.zeros((n_channels, n_channels), dtype=np.complex64)
-                J_hat = np.zeros((n_channels,), dtype=np.complex64)
-                for x_hat in X_hat:
-                    for o, y_hat in enumerate(Y_hat):
-                        x_hat_ij = x_hat[o, :, j, k][:]
-                        H_hat += np.conj(x_hat_ij[..., None]).dot(
-                            x_hat_ij[None, ...])
-                        J_hat += np.conj(x_hat_ij) * y_hat[j, k]
-                H_hat += l * np.eye(H_hat.shape[0])
-                self.f[..., j, k] = np.linalg.solve(H_hat, J_hat)
-
-    def __call__(self, x):
-        return np.real(
-            ifft2(self.f * np.require(fft2(self._cosine_mask * x),
-                                      dtype=np.complex64)))
+            return c1[..., None].dot(c2[None, ...])
+        return 1
+
+    def _flat_fft2s(self, X, Y):
+        # X_hat: n_samples x n_offsets x n_channels x height x half_width
+        # Y_hat:             n_offsets x              height x half_width
+        X_hat = self._compute_fft2s(X)
+        Y_hat = get_fft_backend().rfft2(np.require(Y, dtype=np.float32))
+        n_offsets, height, half_width = Y_hat.shape
+        # flatten frequencies and samples
+        # X_hat: (height x half_width) x (n_samples x n_offsets) x n_channels
+        # Y_hat: (height x half_width) x (n_samples x n_offsets) x 1
+        X_hat = np.rollaxis(np.rollaxis(X_hat, -1), -1).reshape(
+            (height * half_width, -1, X_hat.shape[2]))
+        Y_hat = np.tile(Y_hat.reshape((n_offsets, -1)).T[:, None, :],
+                        (1, len(X), 1)).reshape((height * half_width, -1, 1))
+        return X_hat, Y_hat
+
+    @classmethod
+    def _compute_statistics(cls, X_hat, Y_hat):
+        # build all per-frequency hessians and jacobians at once
+        # H_hat: (height x width) x n_channels x n_channels
+        # J_hat: (height x width) x n_channels x 1
+        X_hat_H = np.conj(X_hat).swapaxes(-2, -1)
+        return np.matmul(X_hat_H, X_hat), np.matmul(X_hat_H, Y_hat)
+
+    @classmethod
+    def _solve_primal(cls, H_hat, J_hat, l):
+        H_hat = H_hat + l * np.eye(H_hat.shape[-1], dtype=np.complex64)
+        # f: (height x width) x n_channels
+        return np.linalg.solve(H_hat, J_hat)[..., 0]
+
+    @classmethod
+    def _solve_dual(cls, X_hat, Y_hat, l):
+        # by the Woodbury identity
+        #   (X^H X + l I)^-1 X^H y = X^H (X X^H + l I)^-1 y
+        # so only (n_samples x n_offsets) systems need to be solved
+        # K_hat: (height x width) x n_samples x n_samples
+        X_hat_H = np.conj(X_hat).swapaxes(-2, -1)
+        K_hat = np.matmul(X_hat, X_hat_H)
+        K_hat += l * np.eye(K_hat.shape[-1], dtype=np.complex64)
+        # a_hat: (height x width) x n_samples x 1
+        a_hat = np.linalg.solve(K_hat, Y_hat)
+        # f: (height x width) x n_channels
+        return np.matmul(X_hat_H, a_hat)[..., 0]
 
     def _compute_fft2s(self, X):
-        X_hat = []
-        for x in X:
-            x_hat = np.require(fft2(self._cosine_mask * x),
-                               dtype=np.complex64)
-            X_hat.append(x_hat)
-        return X_hat
+        return get_fft_backend().rfft2(
+            np.require(self._cosine_mask * np.asarray(X), dtype=np.float32))
+
+
+class IncrementalMCF(MCF):
+    r"""
+    Multi-channel Correlation Filter trained incrementally
+
+    Only the per-frequency hessians and jacobians of the samples seen so far
+    are kept in memory, so the filter can be trained from an arbitrarily
+    large stream of samples. Once all samples have been added, ``finalize``
+    solves for the same filter that :map:`MCF` would have obtained from
+    the whole set of samples.
+    """
+    def __init__(self, Y, l=0, cosine_mask=False):
+
+        height, width = Y[0].shape
+
+        self.l = l
+        self.n_samples = 0
+        self._Y = Y
+        self._spatial_shape = (height, width)
+        self._cosine_mask = self._build_cosine_mask(height, width,
+                                                    cosine_mask)
+        self._H_hat = None
+        self._J_hat = None
+        self.f = None
+
+    def increment(self, X):
+        r"""
+        Folds a new set of samples into the filter's sufficient statistics.
+
+        Parameters
+        ----------
+        X : ``(n_offsets, n_channels, height, width)`` `ndarray` or `list`
+            of those
+            The new sample(s).
+        """
+        if self.f is not None:
+            raise ValueError('The filter has already been finalized')
+        X = np.asarray(X)
+        if X.ndim == 4:
+            X = X[None, ...]
+
+        if (X.shape[1],) + X.shape[-2:] != ((len(self._Y),) +
+                                            self._Y[0].shape):
+            raise ValueError('')
+
+        X_hat, Y_hat = self._flat_fft2s(X, self._Y)
+        H_hat, J_hat = self._compute_statistics(X_hat, Y_hat)
+        if self._H_hat is None:
+            self._H_hat, self._J_hat = H_hat, J_hat
+        else:
+            self._H_hat += H_hat
+            self._J_hat += J_hat
+        self.n_samples += X.shape[0]
+
+    def finalize(self):
+        r"""
+        Solves for the filter and releases the sufficient statistics.
+
+        Returns
+        -------
+        mcf : :map:`IncrementalMCF`
+            The trained filter (self).
+        """
+        if self._H_hat is None:
+            raise ValueError('At least one sample must be added before '
+                             'finalizing the filter')
+
+        height, width = self._Y[0].shape
+        n_channels = self._H_hat.shape[-1]
+
+        f = self._solve_primal(self._H_hat, self._J_hat, self.l)
+        self.f = np.require(f.T.reshape((n_channels, height, -1)),
+                            dtype=np.complex64, requirements=['C'])
+        self._H_hat, self._J_hat = None, None
+
+        return self
 
 
 class MultipleMCF(object):
     r"""
     Multiple of Multi-channel Correlation Filter
+
+    Filters are stored as the non-redundant half of their spectra.
+
+    Parameters
+    ----------
+    clfs : `list` of :map:`MCF`
+        The filter of each landmark.
+    mode : ``{'auto', 'fourier', 'spatial'}``, optional
+        Domain in which responses are computed. ``'spatial'`` evaluates the
+        (circular) correlations directly from the real-space filters, which
+        only pays off for tiny parts. ``'auto'`` uses it whenever the area
+        of the parts does not exceed the ``spatial_crossover`` measured for
+        the current FFT backend.
     """
-    def __init__(self, clfs):
+    def __init__(self, clfs, mode='auto'):
 
         self._cosine_mask = clfs[0]._cosine_mask
+        self._spatial_shape = clfs[0]._spatial_shape
+        self._projection = None
+        self.mode = mode
 
         # concatenate all filters
-        n_channels, height, width = clfs[0].f.shape
+        n_channels, height, half_width = clfs[0].f.shape
         n_landmarks = len(clfs)
-        self.F = np.zeros((n_landmarks, n_channels, height, width),
+        self.F = np.zeros((n_landmarks, n_channels, height, half_width),
                           dtype=np.complex64)
         for j, clf in enumerate(clfs):
             self.F[j, ...] = clf.f
 
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d.pop('_buffers', None)
+        d.pop('_spatial_filters', None)
+        return d
+
+    def __setstate__(self, state):
+        _half_spectrum_state(state, 'F')
+        state.setdefault('mode', 'auto')
+        state.setdefault('_projection', None)
+        self.__dict__.update(state)
+
+    @property
+    def n_channels(self):
+        r"""
+        The number of channels of the parts images.
+
+        :type: `int`
+        """
+        if self._projection is not None:
+            return self._projection.shape[-1]
+        return self.F.shape[1]
+
+    @property
+    def rank(self):
+        r"""
+        The number of rank-1 (channel by spatial) terms that make up each
+        filter, i.e. the number of channels over which responses are
+        actually computed.
+
+        :type: `int`
+        """
+        return self.F.shape[1]
+
+    def compress(self, energy=0.99, max_rank=None):
+        r"""
+        Approximates every filter by a small number of rank-1 terms, each
+        being the outer product of a channel weighting and a spatial
+        filter, obtained from the SVD of the filter's channels.
+
+        Parts are then projected onto the channel weightings before being
+        correlated with the spatial filters, so that only ``rank`` channels
+        need to be transformed and added up per landmark.
+
+        Parameters
+        ----------
+        energy : `float`, optional
+            Fraction of the energy of every filter that must be retained.
+            All filters share the largest rank required by any of them.
+        max_rank : `int`, optional
+            Maximum number of rank-1 terms per filter.
+
+        Returns
+        -------
+        multiple_mcf : :map:`MultipleMCF`
+            The compressed filters (self).
+        """
+        height, width = self._spatial_shape
+        f = self._real_filters()
+        n_landmarks, n_channels = f.shape[:2]
+
+        # f_l ~= u_l s_l v_l^T
+        u, s, v = np.linalg.svd(f.reshape((n_landmarks, n_channels, -1)),
+                                full_matrices=False)
+        s2 = np.cumsum(s**2, axis=-1)
+        total = s2[:, -1:]
+        # filters without energy, e.g. of landmarks that were never trained,
+        # need a single (zero) term
+        s2 = np.where(total > 0,
+                      s2 / np.maximum(total, np.finfo(s2.dtype).tiny), 1)
+        rank = np.max(np.sum(s2 < energy - 1e-12, axis=-1) + 1)
+        if max_rank is not None:
+            rank = min(rank, max_rank)
+
+        # projection: n_landmarks x rank x n_channels
+        self._projection = np.require(
+            np.swapaxes(u[..., :rank] * s[:, None, :rank], -2, -1),
+            dtype=np.float32, requirements=['C'])
+        v = v[:, :rank].reshape((n_landmarks, rank, height, width))
+        self.F = get_fft_backend().rfft2(np.require(v, dtype=np.float32))
+        self.__dict__.pop('_spatial_filters', None)
+
+        return self
+
     def __call__(self, parts_image):
+        r"""
+        Computes the normalized responses of all filters.
+
+        Parameters
+        ----------
+        parts_image : :map:`Image` or `ndarray` or `list`
+            The parts image, or a batch of parts images given as their
+            stacked pixels ``(n_images, n_landmarks, n_offsets, n_channels,
+            height, width)`` or as a `list`. The responses of a batch are
+            computed with a single transform.
+
+        Returns
+        -------
+        parts_response : ``([n_images,] n_landmarks, height, width)``
+        `ndarray`
+            The responses.
+        """
+        pixels = parts_pixels(parts_image)[..., 0, :, :, :]
+
+        # apply cosine mask in single precision
+        x = self._buffer('x', pixels.shape, np.float32)
+        np.multiply(self._cosine_mask, pixels, out=x)
+
+        if self._projection is not None:
+            # project the channels of every part onto its filter's channel
+            # weightings
+            # x: ([n_images x] n_landmarks) x rank x (height x width)
+            height, width = x.shape[-2:]
+            z = self._buffer('z', x.shape[:-3] + (self.rank, height * width),
+                             np.float32)
+            np.matmul(self._projection, x.reshape(x.shape[:-2] + (-1,)),
+                      out=z)
+            x = z.reshape(z.shape[:-1] + (height, width))
 
         # compute responses
-        parts_response = np.sum(np.real(ifft2(
-            self.F * np.require(fft2(self._cosine_mask *
-                                     parts_image.pixels[:, 0, :, ...]),
-                                dtype=np.complex64))), axis=-3)
+        if self._use_spatial():
+            parts_response = self._spatial_response(x)
+        else:
+            parts_response = self._fourier_response(x)
 
         # normalize
         min_parts_response = np.min(parts_response,
@@ -97,43 +350,205 @@ class MultipleMCF(object):
         return parts_response
 
     def invert_filters(self):
-        return np.real(fftshift(ifft2(self.F), axes=(-2, -1)))
+        return fftshift(self._real_filters(), axes=(-2, -1))
+
+    def _real_filters(self):
+        f = get_fft_backend().irfft2(self.F, s=self._spatial_shape)
+        if self._projection is not None:
+            # recombine the rank-1 terms of every filter
+            f = np.matmul(np.swapaxes(self._projection, -2, -1),
+                          f.reshape(f.shape[:2] + (-1,))).reshape(
+                f.shape[:1] + (self.n_channels,) + f.shape[2:])
+        return f
+
+    def _use_spatial(self):
+        if self.mode == 'auto':
+            height, width = self._spatial_shape
+            crossover = getattr(get_fft_backend(), 'spatial_crossover', 0)
+            return height * width <= crossover
+        elif self.mode in ('fourier', 'spatial'):
+            return self.mode == 'spatial'
+        else:
+            raise ValueError("mode must be 'auto', 'fourier' or 'spatial'")
+
+    def _fourier_response(self, x):
+        fft = get_fft_backend()
+        # add up the channels' contributions in the Fourier domain so that
+        # a single inverse transform is required per landmark
+        shape = x.shape[:-4] + self.F.shape
+        x_hat = fft.rfft2(x, out=self._buffer('x_hat', shape, np.complex64))
+        np.multiply(self.F, x_hat, out=x_hat)
+        r_hat = np.sum(x_hat, axis=-3,
+                       out=self._buffer('r_hat', shape[:-3] + shape[-2:],
+                                        np.complex64))
+        return fft.irfft2(r_hat, s=self._spatial_shape)
+
+    def _spatial_response(self, x):
+        batch_shape = x.shape[:-4]
+        n_landmarks, n_channels, height, width = x.shape[-4:]
+        x = x.reshape((-1,) + x.shape[-4:])
+        # the responses are the circular convolutions of the parts with the
+        # real-space filters, i.e. their correlations with the flipped
+        # filters g, with g[..., a, b] = f[..., -a, -b]
+        if getattr(self, '_spatial_filters', None) is None:
+            f = get_fft_backend().irfft2(self.F, s=self._spatial_shape)
+            g = np.roll(np.roll(f[..., ::-1, ::-1], 1, axis=-2), 1, axis=-1)
+            self._spatial_filters = np.require(
+                g.reshape((n_landmarks, -1, 1)), dtype=np.float32,
+                requirements=['C'])
+        # periodically extend the parts
+        x = np.concatenate((x, x[..., :height - 1, :]), axis=-2)
+        x = np.concatenate((x, x[..., :width - 1]), axis=-1)
+        # gather every window of every landmark, so that all responses are
+        # given by a single batched matrix product
+        # windows: n_images x n_landmarks x (height x width) x
+        #          (n_channels x height x width)
+        s = x.strides
+        windows = as_strided(
+            x, shape=(x.shape[0], n_landmarks, height, width, n_channels,
+                      height, width),
+            strides=(s[0], s[1], s[3], s[4], s[2], s[3], s[4]))
+        windows = windows.reshape((x.shape[0], n_landmarks, height * width,
+                                   -1))
+        r = np.matmul(windows, self._spatial_filters)
+        return r.reshape(batch_shape + (n_landmarks, height, width))
+
+    def _buffer(self, key, shape, dtype):
+        # preallocated work arrays, reused for as long as the shape of the
+        # parts images does not change
+        buffers = self.__dict__.setdefault('_buffers', {})
+        buffer = buffers.get(key)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=dtype)
+            buffers[key] = buffer
+        return buffer
+
+
+def _half_spectrum_state(state, key):
+    # filters pickled before half spectra were adopted store the full
+    # (Hermitian) spectra, keep only their non-redundant half
+    if '_spatial_shape' not in state:
+        height, width = state[key].shape[-2:]
+        state['_spatial_shape'] = (height, width)
+        state[key] = np.require(state[key][..., :width // 2 + 1],
+                                dtype=np.complex64, requirements=['C'])
+
+
+# options of LinearSVC without an equivalent in SGDClassifier
+_linear_svc_options = ('dual', 'intercept_scaling', 'multi_class')
 
 
 class LinearSVMLR(object):
     r"""
     Binary classifier that combines Linear Support Vector Machines and
     Logistic Regression.
+
+    Parameters
+    ----------
+    samples : `list` of ``(n_offsets, n_channels, height, width)`` `ndarray`
+        The training samples.
+    mask : ``(1, height, width)`` `ndarray`
+        The desired response. Pixels whose response is at least
+        ``threshold`` are positives, the rest are negatives.
+    threshold : `float`, optional
+        The response threshold separating positives from negatives.
+    max_negatives : `int` or ``None``, optional
+        If not ``None``, at most ``max_negatives`` negatives, drawn at random
+        from all samples, are used for training.
+    n_mining_rounds : `int`, optional
+        Number of hard negative mining rounds. On each round the classifier
+        is retrained on the random negatives together with the
+        ``max_negatives`` negatives of all samples that it scores highest.
+        Only used if ``max_negatives`` is not ``None``.
+    batch_size : `int` or ``None``, optional
+        If ``None``, the linear classifier is a ``LinearSVC`` fitted on the
+        whole training set. Otherwise, it is a ``SGDClassifier`` fitted with
+        ``partial_fit`` on mini-batches of ``batch_size`` samples.
+    n_epochs : `int`, optional
+        Number of passes over the training set per round of ``partial_fit``.
+        Only used if ``batch_size`` is not ``None``.
+    random_state : `int` or ``None``, optional
+        Seed of the negative subsampling and of the mini-batch shuffling.
+    kwarg : `dict`
+        Passed to the ``LinearSVC`` or ``SGDClassifier``. For the latter,
+        ``C`` is translated into the equivalent ``alpha = 1 / (C *
+        n_samples)`` and the options that only ``LinearSVC`` accepts
+        (``dual``, ``intercept_scaling`` and ``multi_class``) are ignored.
     """
-    def __init__(self, samples, mask, threshold=0.05, **kwarg):
+    def __init__(self, samples, mask, threshold=0.05, max_negatives=None,
+                 n_mining_rounds=0, batch_size=None, n_epochs=5,
+                 random_state=None, **kwarg):
 
         mask = mask[0]
+        rng = np.random.RandomState(random_state)
+
+        C = None
+        if batch_size is not None:
+            kwarg = dict(kwarg)
+            C = kwarg.pop('C', None)
+            for k in _linear_svc_options:
+                kwarg.pop(k, None)
+
+        true_index = np.flatnonzero(mask >= threshold)
+        false_index = np.flatnonzero(mask < threshold)
+        n_false = len(false_index)
+
+        # samples: n_samples x n_channels x (height x width)
+        samples = np.asarray([x[0] for x in samples])
+        n_samples, n_channels = samples.shape[:2]
+        samples = samples.reshape((n_samples, n_channels, -1))
+
+        pos_samples = np.rollaxis(samples[..., true_index], 2, 1).reshape(
+            (-1, n_channels))
+
+        # negatives are indexed over n_samples x n_false
+        n_negatives = n_samples * n_false
+        if max_negatives is None or max_negatives >= n_negatives:
+            neg = np.arange(n_negatives)
+            n_mining_rounds = 0
+        else:
+            neg = rng.choice(n_negatives, max_negatives, replace=False)
+        random_neg = neg
+
+        t = np.hstack((np.ones((len(pos_samples),)), -np.ones((len(neg),))))
+
+        for r in range(n_mining_rounds + 1):
+            if r > 0:
+                # add the negatives scored highest by the current classifier
+                # to the random ones
+                scores = np.dot(self.clf1.coef_[0], samples)[:, false_index]
+                hard = np.argpartition(-scores.ravel(),
+                                       max_negatives - 1)[:max_negatives]
+                neg = np.union1d(random_neg, hard)
+                t = np.hstack((np.ones((len(pos_samples),)),
+                               -np.ones((len(neg),))))
+
+            neg_samples = samples[neg // n_false, :,
+                                  false_index[neg % n_false]]
+            X = np.vstack((pos_samples, neg_samples))
+
+            if batch_size is None:
+                self.clf1 = svm.LinearSVC(class_weight='auto', **kwarg)
+                self.clf1.fit(X, t)
+            else:
+                if r == 0:
+                    self.clf1 = linear_model.SGDClassifier(random_state=rng,
+                                                           **kwarg)
+                # partial_fit cannot infer balanced class weights
+                self.clf1.set_params(
+                    class_weight={1: len(t) / (2 * len(pos_samples)),
+                                  -1: len(t) / (2 * len(neg))})
+                if C is not None:
+                    # the regularization of LinearSVC is not averaged over
+                    # the samples
+                    self.clf1.set_params(alpha=1 / (C * len(t)))
+                for _ in range(n_epochs):
+                    order = rng.permutation(len(t))
+                    for k in range(0, len(t), batch_size):
+                        batch = order[k:k + batch_size]
+                        self.clf1.partial_fit(X[batch], t[batch],
+                                              classes=np.array([-1, 1]))
 
-        n_samples = len(samples)
-        n_offsets, n_channels, height, width = samples[0].shape
-
-        true_mask = mask >= threshold
-        false_mask = mask < threshold
-
-        n_true = len(mask[true_mask])
-        n_false = len(mask[false_mask][::])
-
-        pos_labels = np.ones((n_true * n_samples,))
-        neg_labels = -np.ones((n_false * n_samples,))
-
-        pos_samples = np.zeros((n_channels, n_true * n_samples))
-        neg_samples = np.zeros((n_channels, n_false * n_samples))
-        for j, x in enumerate(samples):
-            pos_index = j*n_true
-            pos_samples[:, pos_index:pos_index+n_true] = x[0, :, true_mask].T
-            neg_index = j*n_false
-            neg_samples[:, neg_index:neg_index+n_false] = x[0, :, false_mask].T
-
-        X = np.vstack((pos_samples.T, neg_samples.T))
-        t = np.hstack((pos_labels, neg_labels))
-
-        self.clf1 = svm.LinearSVC(class_weight='auto', **kwarg)
-        self.clf1.fit(X, t)
         t1 = self.clf1.decision_function(X)
         self.clf2 = linear_model.LogisticRegression(class_weight='auto')
         self.clf2.fit(t1[..., None], t)
@@ -147,21 +562,74 @@ class MultipleLinearSVMLR(object):
     r"""
     Multiple Binary classifier that combines Linear Support Vector Machines
     and Logistic Regression.
+
+    The linear decision functions and their logistic calibrations are packed
+    into dense arrays, hence the trained sklearn estimators are not kept.
     """
     def __init__(self, clfs):
 
-        self.classifiers = clfs
         self.n_clfs = len(clfs)
+        self.W, self.b = self._pack(clfs)
+
+    def __setstate__(self, state):
+        # older pickles store the trained classifiers themselves
+        if 'classifiers' in state:
+            clfs = state.pop('classifiers')
+            state['W'], state['b'] = self._pack(clfs)
+        self.__dict__.update(state)
+
+    @classmethod
+    def _pack(cls, clfs):
+        r"""
+        Folds the logistic calibration ``sigmoid(a * (w^T x + b) + c)`` of
+        each classifier into a single affine function ``sigmoid(w'^T x +
+        b')``.
+
+        Parameters
+        ----------
+        clfs : `list` of :map:`LinearSVMLR`
+            The trained classifiers.
+
+        Returns
+        -------
+        W : ``(n_clfs, n_channels)`` `ndarray`
+            The calibrated weights.
+        b : ``(n_clfs,)`` `ndarray`
+            The calibrated biases.
+        """
+        w = np.vstack([clf.clf1.coef_ for clf in clfs])
+        b = np.hstack([clf.clf1.intercept_ for clf in clfs])
+        a = np.hstack([clf.clf2.coef_[:, 0] for clf in clfs])
+        c = np.hstack([clf.clf2.intercept_ for clf in clfs])
+        return a[:, None] * w, a * b + c
 
     def __call__(self, parts_image):
-
-        h, w = parts_image.shape[-2:]
-        parts_pixels = parts_image.pixels
-
-        parts_response = np.zeros((self.n_clfs, h, w))
-        for j, clf in enumerate(self.classifiers):
-            i = parts_pixels[j, ...].reshape((parts_image.shape[-3], -1))
-            parts_response[j, ...] = clf(i.T).reshape((h, w))
+        r"""
+        Computes the normalized responses of all classifiers.
+
+        Parameters
+        ----------
+        parts_image : :map:`Image` or `ndarray` or `list`
+            The parts image, or a batch of parts images given as their
+            stacked pixels ``(n_images, n_landmarks, n_offsets, n_channels,
+            height, width)`` or as a `list`.
+
+        Returns
+        -------
+        parts_response : ``([n_images,] n_landmarks, height, width)``
+        `ndarray`
+            The responses.
+        """
+        pixels = parts_pixels(parts_image)[..., 0, :, :, :]
+        h, w = pixels.shape[-2:]
+
+        # parts_response: [n_images x] n_landmarks x (h x w)
+        pixels = pixels.reshape(pixels.shape[:-2] + (h * w,))
+        parts_response = np.matmul(self.W[:, None, :], pixels)[..., 0, :]
+        parts_response += self.b[:, None]
+        expit(parts_response, out=parts_response)
+        parts_response = parts_response.reshape(
+            parts_response.shape[:-1] + (h, w))
 
         # normalize
         min_parts_response = np.min(parts_response,
@@ -171,3 +639,27 @@ class MultipleLinearSVMLR(object):
                                  axis=(-2, -1))[..., None, None]
 
         return parts_response
+
+
+def parts_pixels(parts_image):
+    r"""
+    Returns the pixels of a parts image or the stacked pixels of a batch of
+    parts images.
+
+    Parameters
+    ----------
+    parts_image : :map:`Image` or `ndarray` or `list`
+        A parts image, the (stacked) pixels of one or more parts images or
+        a `list` of parts images.
+
+    Returns
+    -------
+    pixels : ``([n_images,] n_landmarks, n_offsets, n_channels, height,
+    width)`` `ndarray`
+        The pixels.
+    """
+    if isinstance(parts_image, np.ndarray):
+        return parts_image
+    elif isinstance(parts_image, (list, tuple)):
+        return np.asarray([parts_pixels(i) for i in parts_image])
+    return parts_image.pixels
@@ -0,0 +1,136 @@
+from __future__ import division
+import copy
+import numpy as np
+
+
+# Concrete Implementations of FFT Backends ------------------------------------
+
+class NumpyFFT(object):
+    r"""
+    FFT backend based on ``numpy.fft``.
+
+    Transforms are single-threaded. Versions of numpy prior to 2.0 always
+    compute in double precision, in which case results are cast down to
+    single precision and copied into ``out`` if given.
+    """
+    # largest parts area for which direct (spatial) correlation beats the
+    # transforms of this backend, measured on 68 landmarks x 36 channels
+    spatial_crossover = 9
+
+    def __init__(self):
+        self._supports_out = int(np.__version__.split('.')[0]) >= 2
+
+    def rfft2(self, x, out=None):
+        if self._supports_out and out is not None:
+            return np.fft.rfft2(x, out=out)
+        return _copy_to(np.require(np.fft.rfft2(x), dtype=np.complex64),
+                        out)
+
+    def irfft2(self, x, s, out=None):
+        if self._supports_out and out is not None:
+            # numpy does not return out for inverse transforms of several
+            # axes, only its last one-dimensional transform is written there
+            return _copy_to(np.fft.irfft2(x, s=s, out=out), out)
+        return _copy_to(np.require(np.fft.irfft2(x, s=s), dtype=np.float32),
+                        out)
+
+
+class ScipyFFT(object):
+    r"""
+    FFT backend based on ``scipy.fft``.
+
+    Transforms are computed natively in single precision and the batch of
+    transforms is split among ``workers`` threads. Outputs given as ``out``
+    are filled by copying the results, since ``scipy.fft`` allocates them.
+
+    Parameters
+    ----------
+    workers : `int`, optional
+        Maximum number of threads used by each transform. If negative,
+        the value wraps around from the number of available CPUs, i.e. -1
+        uses all of them.
+    """
+    # batched scipy.fft transforms beat direct (spatial) correlation for
+    # every parts shape, down to 3 x 3
+    spatial_crossover = 0
+
+    def __init__(self, workers=-1):
+        import scipy.fft  # only available from scipy 1.4
+        self._fft = scipy.fft
+        self.workers = workers
+
+    def rfft2(self, x, out=None):
+        return _copy_to(self._fft.rfft2(x, workers=self.workers), out)
+
+    def irfft2(self, x, s, out=None):
+        return _copy_to(self._fft.irfft2(x, s=s, workers=self.workers), out)
+
+
+def _copy_to(x, out):
+    # for transforms that cannot write into preallocated outputs, so that
+    # out is filled whenever it is given
+    if out is None or x is out:
+        return x
+    out[...] = x
+    return out
+
+
+# FFT Backend Selection -------------------------------------------------------
+
+_fft_backend = None
+
+
+def get_fft_backend():
+    r"""
+    Returns the FFT backend used by the correlation filters.
+
+    Defaults to :map:`ScipyFFT` using all available CPUs and falls back to
+    :map:`NumpyFFT` if ``scipy.fft`` is not available.
+
+    Returns
+    -------
+    backend : :map:`ScipyFFT` or :map:`NumpyFFT`
+        The current FFT backend.
+    """
+    global _fft_backend
+    if _fft_backend is None:
+        try:
+            _fft_backend = ScipyFFT()
+        except ImportError:
+            _fft_backend = NumpyFFT()
+    return _fft_backend
+
+
+def set_fft_backend(backend):
+    r"""
+    Sets the FFT backend used by the correlation filters.
+
+    Parameters
+    ----------
+    backend : :map:`ScipyFFT` or :map:`NumpyFFT` or `None`
+        Any object implementing ``rfft2(x, out=None)`` and
+        ``irfft2(x, s, out=None)``. If ``None``, the default backend is
+        restored.
+    """
+    global _fft_backend
+    _fft_backend = backend
+
+
+def limit_fft_threads(n_threads):
+    r"""
+    Limits the number of threads used by every transform of the current
+    FFT backend, e.g. in every worker of a process pool so that the workers
+    do not oversubscribe the CPUs.
+
+    Parameters
+    ----------
+    n_threads : `int` or ``None``
+        The number of threads. If ``None``, nothing is limited.
+    """
+    backend = get_fft_backend()
+    if n_threads is None or getattr(backend, 'workers', None) is None:
+        # single-threaded backends
+        return
+    backend = copy.copy(backend)
+    backend.workers = n_threads
+    set_fft_backend(backend)
@@ -0,0 +1,160 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from alabortcvpr2015.clm.classifier import MCF, MultipleMCF, LinearSVMLR
+
+
+def _mcf_samples(n_samples, n_offsets, n_channels, shape=(6, 7), seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.randn(n_samples, n_offsets, n_channels, *shape)
+    Y = rng.randn(n_offsets, *shape)
+    return X, Y
+
+
+def _reference_filter(X, Y, l):
+    # solve the system of every frequency on its own, in double precision
+    n_samples, n_offsets, n_channels, height, width = X.shape
+    X_hat = np.fft.fft2(X)
+    Y_hat = np.fft.fft2(Y)
+    f = np.zeros((n_channels, height, width), dtype=np.complex128)
+    for u in range(height):
+        for v in range(width):
+            x = X_hat[..., u, v].reshape((-1, n_channels))
+            y = np.tile(Y_hat[:, u, v], n_samples)
+            H = x.conj().T.dot(x) + l * np.eye(n_channels)
+            f[:, u, v] = np.linalg.solve(H, x.conj().T.dot(y))
+    return f
+
+
+def _assert_filters_close(f, f_ref):
+    half_width = f_ref.shape[-1] // 2 + 1
+    assert f.shape == f_ref.shape[:-1] + (half_width,)
+    assert_allclose(f, f_ref[..., :half_width], rtol=1e-3,
+                    atol=1e-4 * np.abs(f_ref).max())
+
+
+def test_mcf_primal_matches_reference():
+    # more samples than channels
+    X, Y = _mcf_samples(6, 2, 3)
+    _assert_filters_close(MCF(X, Y, l=0.1).f, _reference_filter(X, Y, 0.1))
+
+
+def test_mcf_dual_matches_reference():
+    # more channels than samples
+    X, Y = _mcf_samples(2, 1, 8)
+    _assert_filters_close(MCF(X, Y, l=0.1).f, _reference_filter(X, Y, 0.1))
+
+
+def test_mcf_response_matches_full_spectrum():
+    X, Y = _mcf_samples(6, 1, 3)
+    clf = MCF(X, Y, l=0.1, cosine_mask=True)
+    x = np.random.RandomState(1).randn(3, 6, 7)
+    f_ref = _reference_filter(X * clf._cosine_mask, Y, 0.1)
+    response = np.real(np.fft.ifft2(f_ref * np.fft.fft2(clf._cosine_mask *
+                                                        x)))
+    assert_allclose(clf(x), response, atol=1e-4 * np.abs(response).max())
+
+
+def test_mcf_loads_full_spectrum_state():
+    # filters pickled before half spectra were adopted
+    X, Y = _mcf_samples(6, 1, 3)
+    clf = MCF(X, Y, l=0.1)
+    state = clf.__dict__.copy()
+    del state['_spatial_shape']
+    f_full = _reference_filter(X, Y, 0.1)
+    state['f'] = f_full
+    old = MCF.__new__(MCF)
+    old.__setstate__(state)
+    assert old._spatial_shape == (6, 7)
+    assert old.f.dtype == np.complex64
+    _assert_filters_close(old.f, f_full)
+    x = np.random.RandomState(1).randn(3, 6, 7)
+    assert_allclose(old(x), clf(x), atol=1e-4 * np.abs(clf(x)).max())
+
+
+def _multiple_mcf(n_landmarks=3, n_channels=4, shape=(6, 7)):
+    clfs = [MCF(*_mcf_samples(5, 1, n_channels, shape=shape, seed=j),
+                l=0.1, cosine_mask=True)
+            for j in range(n_landmarks)]
+    rng = np.random.RandomState(n_landmarks)
+    parts = rng.randn(2, n_landmarks, 1, n_channels, *shape)
+    return clfs, parts
+
+
+def _normalized(response):
+    response = response - response.min(axis=(-2, -1))[..., None, None]
+    return response / response.max(axis=(-2, -1))[..., None, None]
+
+
+def test_multiple_mcf_fourier_matches_mcf():
+    clfs, parts = _multiple_mcf()
+    response = MultipleMCF(clfs, mode='fourier')(parts)
+    for i, p in enumerate(parts):
+        for j, clf in enumerate(clfs):
+            expected = _normalized(np.sum(clf(p[j, 0]), axis=0))
+            assert_allclose(response[i, j], expected, atol=1e-4)
+
+
+def test_multiple_mcf_spatial_matches_fourier():
+    clfs, parts = _multiple_mcf()
+    fourier = MultipleMCF(clfs, mode='fourier')
+    spatial = MultipleMCF(clfs, mode='spatial')
+    assert_allclose(spatial(parts), fourier(parts), atol=1e-4)
+    # single parts images
+    assert_allclose(spatial(parts[0]), fourier(parts[0]), atol=1e-4)
+
+
+def test_multiple_mcf_mode():
+    clfs, _ = _multiple_mcf()
+    assert not MultipleMCF(clfs, mode='fourier')._use_spatial()
+    assert MultipleMCF(clfs, mode='spatial')._use_spatial()
+    try:
+        MultipleMCF(clfs, mode='wavelet')._use_spatial()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+
+def test_multiple_mcf_spatial_matches_fourier_compressed():
+    clfs, parts = _multiple_mcf()
+    fourier = MultipleMCF(clfs, mode='fourier').compress(max_rank=2)
+    spatial = MultipleMCF(clfs, mode='spatial').compress(max_rank=2)
+    assert fourier.rank == 2
+    assert_allclose(spatial(parts), fourier(parts), atol=1e-4)
+
+
+def test_multiple_mcf_compress_full_rank():
+    clfs, parts = _multiple_mcf()
+    compressed = MultipleMCF(clfs, mode='fourier').compress(energy=1.)
+    assert compressed.rank == compressed.n_channels == 4
+    uncompressed = MultipleMCF(clfs, mode='fourier')
+    assert_allclose(compressed(parts), uncompressed(parts), atol=1e-4)
+
+
+def test_multiple_mcf_compress_zero_filter():
+    clfs, parts = _multiple_mcf()
+    # a landmark whose filter was never trained
+    clfs[1].f = np.zeros_like(clfs[1].f)
+    rank = MultipleMCF([clfs[0], clfs[2]]).compress(energy=0.9).rank
+    with np.errstate(divide='raise', invalid='raise'):
+        compressed = MultipleMCF(clfs).compress(energy=0.9)
+    assert compressed.rank == rank
+    assert np.all(np.isfinite(compressed._projection))
+    assert np.all(np.isfinite(compressed.F))
+
+
+def _svm_samples(n_samples=10, n_channels=4, shape=(6, 6), seed=0):
+    rng = np.random.RandomState(seed)
+    samples = [rng.randn(1, n_channels, *shape) for _ in range(n_samples)]
+    mask = np.zeros((1,) + shape)
+    mask[0, 2:4, 2:4] = 1
+    return samples, mask
+
+
+def test_linear_svmlr_sgd_accepts_linear_svc_options():
+    samples, mask = _svm_samples()
+    clf = LinearSVMLR(samples, mask, batch_size=32, C=0.5, dual=False,
+                      random_state=0)
+    # every pixel of every sample is a training sample
+    assert_allclose(clf.clf1.alpha, 1 / (0.5 * 10 * 36))
@@ -0,0 +1,33 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from alabortcvpr2015.clm.fourier import NumpyFFT, ScipyFFT
+
+
+def _backends():
+    return [NumpyFFT(), ScipyFFT()]
+
+
+def test_fft_backends_match_numpy():
+    x = np.random.RandomState(0).randn(2, 3, 6, 7).astype(np.float32)
+    x_hat = np.fft.rfft2(x)
+    for fft in _backends():
+        y_hat = fft.rfft2(x)
+        assert y_hat.dtype == np.complex64
+        assert_allclose(y_hat, x_hat, atol=1e-4)
+        y = fft.irfft2(y_hat, s=(6, 7))
+        assert y.dtype == np.float32
+        assert_allclose(y, x, atol=1e-5)
+
+
+def test_fft_backends_fill_out():
+    x = np.random.RandomState(0).randn(2, 3, 6, 7).astype(np.float32)
+    for fft in _backends():
+        out = np.zeros((2, 3, 6, 4), dtype=np.complex64)
+        y_hat = fft.rfft2(x, out=out)
+        assert y_hat is out
+        assert_allclose(out, np.fft.rfft2(x), atol=1e-4)
+        out = np.zeros(x.shape, dtype=np.float32)
+        y = fft.irfft2(y_hat, s=(6, 7), out=out)
+        assert y is out
+        assert_allclose(out, x, atol=1e-5)
@@ -1,5 +1,6 @@
 from __future__ import division
 import abc
+import shutil
 
 import numpy as np
 
@@ -9,6 +10,10 @@ from menpofit.base import noisy_align
 from menpofit.fitter import align_shape_with_bb
 
 from .utils import fsmooth
+from .cache import cached
+from .pyramid import ImagePyramid
+from .parallel import (imap_tasks, n_workers, _shared_directory,
+                       _dump_pixels, _load_pixels)
 from .result import FitterResult
 
 
@@ -18,6 +23,9 @@ class Fitter(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # optional ImageCache of the rescaled and feature images
+    cache = None
+
     @property
     def reference_shape(self):
         r"""
@@ -143,6 +151,157 @@ class Fitter(object):
 
         return fitter_result
 
+    def fit_batch(self, images, initial_shapes, max_iters=50, gt_shapes=None,
+                  **kwargs):
+        r"""
+        Fits the multilevel fitter to several images in lockstep.
+
+        At every level, the parameters of all images are updated at once by
+        the ``run_batch`` method of the algorithm, which stacks the warps,
+        errors and Gauss-Newton solves of the images that did not converge
+        yet. The results are the same as the ones of :meth:`fit` on every
+        image, but the images of every level are kept in memory until the
+        whole batch is fitted.
+
+        Parameters
+        -----------
+        images : `list` of :map:`Image` or subclass
+            The images to be fitted.
+        initial_shapes : `list` of :map:`PointCloud`
+            The initial shape of every image.
+        max_iters : `int` or `list` of `int`, optional
+            The maximum number of iterations, see :meth:`fit`.
+        gt_shapes : `list` of :map:`PointCloud` or ``None``, optional
+            The ground truth shape of every image.
+        kwargs : `dict`
+            Passed to the ``run_batch`` method of the algorithms.
+
+        Returns
+        -------
+        fitter_results : `list` of :map:`FitterResult`
+            The result of every image.
+        """
+        if gt_shapes is None:
+            gt_shapes = [None] * len(images)
+
+        # generate the list of images to be fitted for every image
+        prepared = [self._prepare_image(i, s, gt_shape=g)
+                    for i, s, g in zip(images, initial_shapes, gt_shapes)]
+
+        # detach added landmarks from images
+        for image, gt_shape in zip(images, gt_shapes):
+            del image.landmarks['initial_shape']
+            if gt_shape:
+                del image.landmarks['gt_shape']
+
+        # work out the affine transforms between the initial shapes of the
+        # highest pyramidal level and the initial shapes of the original
+        # images
+        affine_corrections = [AlignmentAffine(p[1][-1], s)
+                              for p, s in zip(prepared, initial_shapes)]
+
+        # run multilevel fitting
+        algorithm_results = self._fit_batch(
+            [p[0] for p in prepared], [p[1][0] for p in prepared],
+            max_iters=max_iters, gt_shapes=[p[2] for p in prepared],
+            **kwargs)
+
+        # build multilevel fitting results
+        return [FitterResult(image, self, results, affine_correction,
+                             gt_shape=gt_shape)
+                for image, results, affine_correction, gt_shape in
+                zip(images, algorithm_results, affine_corrections,
+                    gt_shapes)]
+
+    def fit_many(self, images, initial_shapes, max_iters=50, gt_shapes=None,
+                 n_jobs=1, ordered=True, blas_threads=1, **kwargs):
+        r"""
+        Fits the multilevel fitter to several images, in a pool of
+        ``n_jobs`` forked processes if more than one worker is requested.
+
+        The workers inherit this fitter and its precomputed matrices, which
+        are shared copy-on-write rather than pickled, and every worker runs
+        :meth:`fit` on one image at a time with its BLAS libraries and FFT
+        backend limited to ``blas_threads`` threads. The results are sent
+        back without the references to the fitter, its algorithms and the
+        original image, which are attached again in this process, and the
+        pixels of the images of every level are sent through files in shared
+        memory (``/dev/shm``), memory mapped copy-on-write by this process.
+
+        Parameters
+        -----------
+        images : `list` of :map:`Image` or subclass
+            The images to be fitted.
+        initial_shapes : `list` of :map:`PointCloud`
+            The initial shape of every image.
+        max_iters : `int` or `list` of `int`, optional
+            The maximum number of iterations, see :meth:`fit`.
+        gt_shapes : `list` of :map:`PointCloud` or ``None``, optional
+            The ground truth shape of every image.
+        n_jobs : `int` or ``None``, optional
+            The number of processes, see :map:`n_workers`.
+        ordered : `bool`, optional
+            If ``True``, the results are returned in the order of the
+            images. Otherwise, they are returned as soon as they are
+            available.
+        blas_threads : `int` or ``None``, optional
+            The number of BLAS and FFT threads of every worker, see
+            :map:`limit_threads`.
+        kwargs : `dict`
+            Passed to :meth:`fit`.
+
+        Returns
+        -------
+        results : `generator` of ``(index, fitter_result, error)``
+            The index of every image and either its :map:`FitterResult`
+            and ``None`` or ``None`` and the :map:`TaskError` of its
+            fitting, which does not stop the fitting of the other images.
+        """
+        if gt_shapes is None:
+            gt_shapes = [None] * len(images)
+
+        if min(n_workers(n_jobs), len(images)) <= 1:
+            # fitted in this process, nothing needs to be sent back
+            for output in imap_tasks(
+                    lambda k: self.fit(images[k], initial_shapes[k],
+                                       max_iters=max_iters,
+                                       gt_shape=gt_shapes[k], **kwargs),
+                    len(images), n_jobs=1):
+                yield output
+            return
+
+        directory = _shared_directory()
+
+        def fit(k):
+            result = self.fit(images[k], initial_shapes[k],
+                              max_iters=max_iters, gt_shape=gt_shapes[k],
+                              **kwargs)
+            result.image = None
+            result.fitter = None
+            for r in result.algorithm_results:
+                r.fitter = None
+            paths = [_dump_pixels(r.image, directory)
+                     for r in result.algorithm_results]
+            return result, paths
+
+        try:
+            for k, output, error in imap_tasks(
+                    fit, len(images), n_jobs=n_jobs, ordered=ordered,
+                    blas_threads=blas_threads):
+                result = None
+                if output is not None:
+                    result, paths = output
+                    result.image = images[k]
+                    result.fitter = self
+                    for r, path, a in zip(result.algorithm_results, paths,
+                                          self._algorithms):
+                        _load_pixels(r.image, path)
+                        r.fitter = a
+                yield k, result, error
+        finally:
+            # remove the pixels of results that were never received
+            shutil.rmtree(directory, ignore_errors=True)
+
     def perturb_shape(self, gt_shape, noise_std=0.04, rotation=False):
         r"""
         Generates an initial shape by adding gaussian noise to the perfect
@@ -233,28 +392,23 @@ class Fitter(object):
 
         # rescale image wrt the scale factor between reference_shape and
         # initial_shape
-        image = image.rescale_to_reference_shape(self.reference_shape,
-                                                 group='initial_shape')
-        if self.sigma:
-            image.pixels = fsmooth(image.pixels, self.sigma)
-
-        # obtain image representation
-        from copy import deepcopy
-        scales = deepcopy(self.scales)
-        scales.reverse()
-        images = []
-        for j, s in enumerate(scales):
-            if j == 0:
-                # compute features at highest level
-                feature_image = self.features(image)
-            elif self.scale_features:
-                # scale features at other levels
-                feature_image = images[0].rescale(s)
-            else:
-                # scale image and compute features at other levels
-                scaled_image = image.rescale(s)
-                feature_image = self.features(scaled_image)
-            images.append(feature_image)
+        def normalize(i):
+            i = i.rescale_to_reference_shape(self.reference_shape,
+                                             group='initial_shape')
+            if self.sigma:
+                i.pixels = fsmooth(i.pixels, self.sigma)
+            return i
+
+        image = cached(self.cache, normalize, 'normalize',
+                       self.reference_shape, 'initial_shape', None,
+                       self.sigma)(image)
+
+        # obtain image representation, using the same pyramid as builders
+        scales = list(reversed(self.scales))
+        pyramid = ImagePyramid(scales, features=self.features,
+                               scale_features=self.scale_features,
+                               cache=self.cache)
+        images = list(pyramid.levels(image))
         images.reverse()
 
         # get initial shapes per level
@@ -321,6 +475,41 @@ class Fitter(object):
 
         return algorithm_results
 
+    def _fit_batch(self, images, initial_shapes, gt_shapes=None,
+                   max_iters=50, **kwargs):
+        r"""
+        Fits the fitter to the multilevel pyramidal images of several
+        images in lockstep, see :meth:`_fit`.
+
+        Returns
+        -------
+        algorithm_results : `list` of `list`
+            The algorithm result of every level of every image.
+        """
+
+        max_iters = self._prepare_max_iters(max_iters)
+
+        shapes = initial_shapes
+        algorithm_results = [[] for _ in images]
+        for j, (alg, it, s) in enumerate(zip(self._algorithms, max_iters,
+                                             self.scales)):
+            level_images = [i[j] for i in images]
+            level_gt_shapes = [g[j] if g else None for g in gt_shapes]
+
+            level_results = alg.run_batch(level_images, shapes,
+                                          gt_shapes=level_gt_shapes,
+                                          max_iters=it, **kwargs)
+            for results, r in zip(algorithm_results, level_results):
+                results.append(r)
+
+            shapes = [r.final_shape for r in level_results]
+            if s != self.scales[-1]:
+                for shape in shapes:
+                    Scale(self.scales[j+1]/s,
+                          n_dims=shape.n_dims).apply_inplace(shape)
+
+        return algorithm_results
+
     def _prepare_max_iters(self, max_iters):
 
         n_levels = self.n_levels
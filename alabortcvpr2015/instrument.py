@@ -0,0 +1,192 @@
+from __future__ import division
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    # only available on Python 3
+    tracemalloc = None
+
+
+# Sinks of Instrumentation Events ---------------------------------------------
+
+class MemorySink(object):
+    r"""
+    Collects instrumentation events in memory.
+
+    Attributes
+    ----------
+    events : `list` of `dict`
+        The events, in the order in which stages finished.
+    """
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        r"""
+        Stores an event.
+        """
+        with self._lock:
+            self.events.append(event)
+
+    def stages(self, name):
+        r"""
+        Returns the events of the stages called ``name``.
+        """
+        return [e for e in self.events if e['stage'] == name]
+
+
+class JSONLSink(object):
+    r"""
+    Appends instrumentation events to a file, one JSON object per line.
+
+    The file is opened for every event, so that events of finished stages
+    are on disk even if the computation is killed and several processes
+    can write to the same file.
+
+    Parameters
+    ----------
+    path : `str`
+        The file.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        r"""
+        Appends an event.
+        """
+        line = json.dumps(event, sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+# Measurement of Stages -------------------------------------------------------
+
+# peaks of traced memory of the measured stages that enclose the current one
+_traced_peaks = []
+_traced_lock = threading.Lock()
+
+
+@contextmanager
+def measure(sink, stage, **fields):
+    r"""
+    Context manager measuring a stage of a computation and emitting its
+    event to ``sink`` when it finishes successfully.
+
+    Every event is a `dict` with:
+
+        - ``stage``, the name of the stage, and ``fields``;
+        - ``timestamp``, the time at which the stage finished;
+        - ``wall_time`` and ``cpu_time``, in seconds. The CPU time is the
+          one of the whole process (user and system), hence it includes
+          the time spent by other threads;
+        - ``peak_rss`` and ``peak_rss_delta``, the maximum resident set
+          size of the process at the end of the stage and its increase
+          during the stage, in bytes, or ``None`` if unavailable;
+        - ``traced_delta`` and ``traced_peak``, the change of the memory
+          allocated by Python during the stage and its peak wrt the start
+          of the stage, in bytes, if ``tracemalloc`` is tracing. The peak
+          requires Python >= 3.9.
+
+    Memory is measured for the whole process, so the figures of stages
+    running concurrently in several threads are approximate.
+
+    The body of the ``with`` statement gets the event and can add fields
+    to it, e.g. the number of items only known once the stage runs.
+
+    Parameters
+    ----------
+    sink : :map:`MemorySink`, :map:`JSONLSink` or ``None``
+        Any object with an ``emit(event)`` method. If ``None``, nothing is
+        measured.
+    stage : `str`
+        The name of the stage.
+    fields : `dict`
+        Fields added to the event, e.g. ``level`` or ``n_items``.
+    """
+    event = dict(fields, stage=stage)
+    if sink is None:
+        yield event
+        return
+
+    tracing = tracemalloc is not None and tracemalloc.is_tracing()
+    if tracing:
+        traced_start = _enter_traced()
+    rss_start = _peak_rss()
+    cpu_start = _cpu_time()
+    wall_start = time.time()
+    try:
+        yield event
+    finally:
+        wall_time = time.time() - wall_start
+        cpu_time = _cpu_time() - cpu_start
+        rss = _peak_rss()
+        if tracing:
+            traced, peak = _exit_traced()
+
+    event.update(timestamp=time.time(), wall_time=wall_time,
+                 cpu_time=cpu_time, peak_rss=rss,
+                 peak_rss_delta=(rss - rss_start if rss is not None
+                                 else None))
+    if tracing:
+        event['traced_delta'] = traced - traced_start
+        if peak is not None:
+            event['traced_peak'] = peak - traced_start
+    sink.emit(event)
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on OS X, kilobytes elsewhere
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _enter_traced():
+    # the peak is reset for every stage, the one of the enclosing stage is
+    # kept in _traced_peaks
+    with _traced_lock:
+        traced, peak = tracemalloc.get_traced_memory()
+        if _traced_peaks:
+            _traced_peaks[-1] = max(_traced_peaks[-1], peak)
+        _traced_peaks.append(traced)
+        if _reset_peak is not None:
+            _reset_peak()
+    return traced
+
+
+def _exit_traced():
+    with _traced_lock:
+        traced, peak = tracemalloc.get_traced_memory()
+        peak = max(_traced_peaks.pop(), peak)
+        if _traced_peaks:
+            _traced_peaks[-1] = max(_traced_peaks[-1], peak)
+        if _reset_peak is None:
+            # peaks are the ones since tracing started
+            return traced, None
+        _reset_peak()
+    return traced, peak
+
+
+# only available on Python >= 3.9
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
@@ -0,0 +1,493 @@
+from __future__ import division
+import gc
+import os
+import shutil
+import tempfile
+import traceback
+from collections import deque, OrderedDict
+import multiprocessing
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from menpo.visualize import print_dynamic, progress_bar_str
+
+
+def n_workers(n_jobs):
+    r"""
+    Returns the number of workers requested by ``n_jobs``.
+
+    Parameters
+    ----------
+    n_jobs : `int` or ``None``
+        The number of workers. If negative, the value wraps around from the
+        number of available CPUs, i.e. -1 uses all of them. ``None`` means 1.
+
+    Returns
+    -------
+    n_workers : `int`
+        The number of workers, at least 1.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        n_jobs += cpu_count() + 1
+    return max(n_jobs, 1)
+
+
+def thread_pool(n_jobs):
+    r"""
+    Returns a pool of ``n_jobs`` threads or ``None`` if only one worker is
+    requested.
+
+    Threads share the training data without copying it and are effective
+    whenever the work is dominated by NumPy/LAPACK or liblinear calls, which
+    release the GIL.
+
+    Parameters
+    ----------
+    n_jobs : `int` or ``None``
+        The number of threads, see :map:`n_workers`.
+
+    Returns
+    -------
+    pool : `multiprocessing.pool.ThreadPool` or ``None``
+        The pool.
+    """
+    n_jobs = n_workers(n_jobs)
+    if n_jobs == 1:
+        return None
+    return ThreadPool(n_jobs)
+
+
+def imap(pool, function, iterable):
+    r"""
+    Lazily applies ``function`` to every element of ``iterable``, in the
+    ``pool`` workers if it is not ``None``. Results are returned in order.
+
+    Parameters
+    ----------
+    pool : `multiprocessing.pool.Pool` or ``None``
+        The pool of workers.
+    function : `callable`
+        The function.
+    iterable : `iterable`
+        The arguments.
+
+    Returns
+    -------
+    results : `iterator`
+        The results.
+    """
+    if pool is None:
+        return (function(x) for x in iterable)
+    return pool.imap(function, iterable)
+
+
+# Process Parallel Map over Images --------------------------------------------
+
+# (function, images, directory, started) of the current map, inherited by
+# the forked workers, including the ones replacing workers that died, so
+# that neither the function nor the images need to be pickled
+_task = None
+
+
+def map_images(function, images, n_jobs=1, verbose=False, prefix=''):
+    r"""
+    Applies ``function`` to every image, see :map:`imap_images`.
+
+    Returns
+    -------
+    results : `list`
+        The results.
+    """
+    return list(imap_images(function, images, n_jobs=n_jobs, verbose=verbose,
+                            prefix=prefix))
+
+
+def imap_images(function, images, n_jobs=1, verbose=False, prefix=''):
+    r"""
+    Lazily applies ``function`` to every image, in a pool of ``n_jobs``
+    forked processes if more than one worker is requested.
+
+    Images are dispatched to the workers in chunks of consecutive indices
+    and only a bounded number of chunks is in flight at any time. The pixels
+    of the resulting images are returned through files in shared memory
+    (``/dev/shm``) which are memory mapped copy-on-write by this process,
+    so they are never pickled.
+
+    If a worker dies, e.g. killed for running out of memory, a
+    `RuntimeError` is raised rather than waiting forever for the images it
+    was processing.
+
+    Parameters
+    ----------
+    function : `callable`
+        The function, taking an image and returning an image or any other
+        picklable object.
+    images : `list`
+        The images.
+    n_jobs : `int` or ``None``, optional
+        The number of processes, see :map:`n_workers`.
+    verbose : `bool`, optional
+        If ``True``, the progress is printed after ``prefix``.
+    prefix : `str`, optional
+        The progress message.
+
+    Returns
+    -------
+    results : `generator`
+        The results, in the order of the images.
+    """
+    global _task
+
+    n_images = len(images)
+    n_jobs = min(n_workers(n_jobs), n_images)
+
+    def progress(c):
+        if verbose:
+            print_dynamic('{}{}'.format(
+                prefix, progress_bar_str((c + 1.) / n_images,
+                                         show_bar=False)))
+
+    if n_jobs <= 1:
+        for c, i in enumerate(images):
+            progress(c)
+            yield function(i)
+        return
+
+    directory = _shared_directory()
+    chunk_size = int(np.ceil(n_images / (4 * n_jobs)))
+    chunks = iter([(start, min(start + chunk_size, n_images))
+                   for start in range(0, n_images, chunk_size)])
+
+    context = _fork_context()
+    # the workers report the chunk they start, unbuffered, so that the
+    # chunk of a worker that dies is known
+    started = _simple_queue(context)
+    _task = (function, images, directory, started)
+    try:
+        pool = context.Pool(n_jobs)
+    except Exception:
+        _task = None
+        raise
+
+    pending = deque()
+    # process id of the worker running every started chunk
+    workers = {}
+    try:
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(_map_chunk, (chunk,))))
+            if len(pending) == 2 * n_jobs:
+                break
+        c = 0
+        while pending:
+            chunk, result = pending.popleft()
+            while not result.ready():
+                result.wait(0.1)
+                _update_workers(started, workers)
+                if _is_lost(result, chunk, workers):
+                    raise RuntimeError(
+                        'The worker process {} mapping images {} to {} '
+                        'died'.format(workers[chunk], chunk[0],
+                                      chunk[1] - 1))
+            results = result.get()
+            workers.pop(chunk, None)
+            for chunk in chunks:
+                pending.append((chunk, pool.apply_async(_map_chunk,
+                                                        (chunk,))))
+                break
+            for result, path in results:
+                _load_pixels(result, path)
+                progress(c)
+                c += 1
+                yield result
+    finally:
+        pool.terminate()
+        _task = None
+        # remove the shared memory of results that were never consumed
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _map_chunk(chunk):
+    function, images, directory, started = _task
+    started.put((chunk, os.getpid()))
+    results = []
+    for k in range(*chunk):
+        result = function(images[k])
+        results.append((result, _dump_pixels(result, directory)))
+    return results
+
+
+def _shared_directory():
+    # temporary directory through which workers hand pixels over to this
+    # process, in shared memory if available
+    return tempfile.mkdtemp(
+        dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+
+def _dump_pixels(image, directory):
+    # moves the pixels of an image to a file, so that the image is pickled
+    # without them, and returns its path (None if there are no pixels)
+    if not isinstance(getattr(image, 'pixels', None), np.ndarray):
+        return None
+    fd, path = tempfile.mkstemp(suffix='.npy', dir=directory)
+    os.close(fd)
+    np.save(path, image.pixels)
+    image.pixels = None
+    return path
+
+
+def _load_pixels(image, path):
+    # memory maps copy-on-write the pixels moved by _dump_pixels, the file
+    # is removed but its memory is kept until the pixels are released
+    if path is not None:
+        image.pixels = np.load(path, mmap_mode='c')
+        os.remove(path)
+
+
+# Process Parallel Map of Fallible Tasks --------------------------------------
+
+class TaskError(Exception):
+    r"""
+    Error raised by a task of :map:`imap_tasks`.
+
+    The original exception is not kept, since it might not be picklable,
+    but its formatted traceback is.
+
+    Parameters
+    ----------
+    index : `int`
+        The index of the task.
+    traceback : `str`
+        The formatted traceback of the original exception.
+    """
+    def __init__(self, index, traceback):
+        super(TaskError, self).__init__(index, traceback)
+        self.index = index
+        self.traceback = traceback
+
+    def __str__(self):
+        return 'Task {} failed:\n{}'.format(self.index, self.traceback)
+
+
+# environment variables setting the number of threads of BLAS libraries
+_blas_variables = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                   'NUMEXPR_NUM_THREADS')
+
+
+def limit_blas_threads(n_threads):
+    r"""
+    Limits the number of threads used by the BLAS libraries of this
+    process, e.g. in every worker of a process pool so that the workers do
+    not oversubscribe the CPUs.
+
+    Libraries already loaded are limited through ``threadpoolctl``, if it
+    is installed. The environment variables read by the libraries are set
+    too, for the ones loaded later.
+
+    Parameters
+    ----------
+    n_threads : `int` or ``None``
+        The number of threads. If ``None``, nothing is limited.
+    """
+    if n_threads is None:
+        return
+    for v in _blas_variables:
+        os.environ[v] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=n_threads)
+
+
+def limit_threads(n_threads):
+    r"""
+    Limits the number of threads used by the BLAS libraries and by the FFT
+    backend of this process, see :map:`limit_blas_threads` and
+    :map:`limit_fft_threads`.
+
+    Parameters
+    ----------
+    n_threads : `int` or ``None``
+        The number of threads. If ``None``, nothing is limited.
+    """
+    # the clm package imports this module
+    from alabortcvpr2015.clm.fourier import limit_fft_threads
+    limit_blas_threads(n_threads)
+    limit_fft_threads(n_threads)
+
+
+# (function, started) of the current map of tasks, inherited by the forked
+# workers, including the ones replacing workers that died, so that the
+# function, and everything it refers to, is never pickled
+_tasks = None
+
+
+def imap_tasks(function, n_tasks, n_jobs=1, ordered=True, blas_threads=1):
+    r"""
+    Lazily evaluates ``function(k)`` for every ``k`` in ``range(n_tasks)``,
+    in a pool of ``n_jobs`` forked processes if more than one worker is
+    requested.
+
+    The workers inherit the function and everything it refers to, e.g. a
+    fitter and its precomputed matrices, which are shared copy-on-write
+    with this process rather than pickled. Only the results are pickled.
+    Only a bounded number of tasks is in flight at any time.
+
+    An exception raised by a task is reported as the :map:`TaskError` of
+    that task and the remaining tasks still run. So is a task whose worker
+    died, e.g. killed for running out of memory, in which case the pool
+    replaces the worker.
+
+    Parameters
+    ----------
+    function : `callable`
+        The function, taking the index of a task and returning a picklable
+        result.
+    n_tasks : `int`
+        The number of tasks.
+    n_jobs : `int` or ``None``, optional
+        The number of processes, see :map:`n_workers`.
+    ordered : `bool`, optional
+        If ``True``, results are returned in the order of the tasks.
+        Otherwise, they are returned as soon as they are available.
+    blas_threads : `int` or ``None``, optional
+        The number of BLAS and FFT threads of every worker, see
+        :map:`limit_threads`.
+
+    Returns
+    -------
+    results : `generator` of ``(index, result, error)``
+        The index of every task and either its result and ``None`` or
+        ``None`` and its :map:`TaskError`.
+    """
+    global _tasks
+
+    n_jobs = min(n_workers(n_jobs), n_tasks)
+    if n_jobs <= 1:
+        for k in range(n_tasks):
+            yield _run_task(function, k)
+        return
+
+    context = _fork_context()
+    # import the FFT backends once, before forking, rather than in every
+    # worker initialized by limit_threads
+    import alabortcvpr2015.clm.fourier
+    # the workers report the task they start, unbuffered, so that the task
+    # of a worker that dies is known
+    started = _simple_queue(context)
+    _tasks = (function, started)
+    # objects tracked by the garbage collector before the fork are not
+    # touched by the collections of the workers, which would copy their
+    # pages
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is not None:
+        freeze()
+    try:
+        pool = context.Pool(n_jobs, initializer=limit_threads,
+                            initargs=(blas_threads,))
+    except Exception:
+        _tasks = None
+        raise
+    finally:
+        if freeze is not None:
+            gc.unfreeze()
+
+    tasks = iter(range(n_tasks))
+    pending = OrderedDict()
+    # process id of the worker running every started task
+    workers = {}
+    try:
+        for k in tasks:
+            pending[k] = pool.apply_async(_pool_task, (k,))
+            if len(pending) == 2 * n_jobs:
+                break
+        while pending:
+            candidates = [next(iter(pending))] if ordered else list(pending)
+            pending[candidates[0]].wait(0.1)
+            _update_workers(started, workers)
+            for k in candidates:
+                result = pending[k]
+                if result.ready():
+                    output = result.get()
+                elif _is_lost(result, k, workers):
+                    output = k, None, TaskError(
+                        k, 'The worker process {} running the task '
+                           'died\n'.format(workers[k]))
+                else:
+                    continue
+                del pending[k]
+                workers.pop(k, None)
+                for t in tasks:
+                    pending[t] = pool.apply_async(_pool_task, (t,))
+                    break
+                yield output
+    finally:
+        pool.terminate()
+        _tasks = None
+
+
+def _pool_task(k):
+    function, started = _tasks
+    started.put((k, os.getpid()))
+    return _run_task(function, k)
+
+
+def _run_task(function, k):
+    try:
+        return k, function(k), None
+    except Exception:
+        return k, None, TaskError(k, traceback.format_exc())
+
+
+# Process Pools ---------------------------------------------------------------
+
+# seconds given to the result of a task to arrive once its worker died
+_lost_task_timeout = 1.
+
+
+def _fork_context():
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks
+        return multiprocessing
+
+
+def _simple_queue(context):
+    try:
+        return context.SimpleQueue()
+    except AttributeError:
+        # Python 2
+        from multiprocessing.queues import SimpleQueue
+        return SimpleQueue()
+
+
+def _update_workers(started, workers):
+    # record the worker running every task reported as started
+    while not started.empty():
+        k, pid = started.get()
+        workers[k] = pid
+
+
+def _is_lost(result, k, workers):
+    # whether the worker running the task k died without its result
+    if result.ready() or k not in workers or _is_alive(workers[k]):
+        return False
+    # the result of a task finished right before its worker died might
+    # still be on its way
+    result.wait(_lost_task_timeout)
+    return not result.ready()
+
+
+def _is_alive(pid):
+    # the pool reaps its dead workers, after which their ids do not exist
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
@@ -0,0 +1,382 @@
+from __future__ import division
+import numbers
+import numpy as np
+
+from menpo.model import PCAModel
+
+from .storage import MemmapImages
+from .procrustes import generalized_procrustes_analysis
+
+
+# Incremental PCA -------------------------------------------------------------
+
+class IncrementalPCA(object):
+    r"""
+    Principal Component Analysis whose samples are provided in batches.
+
+    Only the mean, the leading components and their singular values are
+    kept between batches, hence memory does not grow with the number of
+    samples if ``max_n_components`` is given. In that case the model is an
+    approximation of the one built from all samples at once, otherwise both
+    models are the same. The total variance of the samples is always
+    exact, so the variance of the discarded components is kept as in
+    :map:`randomized_pca_model`.
+
+    Parameters
+    ----------
+    max_n_components : `int` or ``None``, optional
+        The maximum number of components kept between batches. If ``None``,
+        all components are kept.
+    """
+    def __init__(self, max_n_components=None):
+        self.max_n_components = max_n_components
+        self.n_samples = 0
+        self._mean = None
+        # sum of squares of all samples around their mean
+        self._sum_squares = 0
+        self._components = None
+        self._singular_values = None
+        self._template = None
+
+    def increment(self, samples):
+        r"""
+        Updates the decomposition with a batch of samples.
+
+        Parameters
+        ----------
+        samples : `list` of :map:`Vectorizable`
+            The batch of samples.
+
+        Returns
+        -------
+        pca : :map:`IncrementalPCA`
+            The updated decomposition.
+        """
+        X = np.array([s.as_vector() for s in samples])
+        n_batch = X.shape[0]
+        if self._template is None:
+            self._template = samples[0]
+
+        batch_mean = np.mean(X, axis=0)
+        X -= batch_mean
+        self._sum_squares += np.einsum('ij,ij->', X, X)
+        if self.n_samples > 0:
+            n_total = self.n_samples + n_batch
+            # the previous samples are summarized by their scaled components
+            # and a single sample accounting for the shift of the mean
+            correction = (np.sqrt(self.n_samples * n_batch / n_total) *
+                          (self._mean - batch_mean))
+            self._sum_squares += correction.dot(correction)
+            X = np.vstack((self._singular_values[:, None] * self._components,
+                           X, correction))
+            self._mean = (self.n_samples * self._mean +
+                          n_batch * batch_mean) / n_total
+        else:
+            self._mean = batch_mean
+        self.n_samples += n_batch
+
+        _, s, v = np.linalg.svd(X, full_matrices=False)
+        n_components = self.max_n_components or len(s)
+        self._singular_values = s[:n_components]
+        self._components = v[:n_components]
+
+        return self
+
+    def finalize(self):
+        r"""
+        Returns the model of all samples provided so far.
+
+        Returns
+        -------
+        pca_model : :map:`PCAModel`
+            The unbiased, centred PCA model.
+        """
+        # discard components of (numerically) zero variance as PCAModel does
+        s = self._singular_values
+        s = s[s**2 > 1e-10 * s[0]**2]
+        eigenvalues = s**2 / (self.n_samples - 1)
+
+        # the variance of the components that were discarded between
+        # batches is spread evenly among them
+        rank = min(self.n_samples - 1, self._mean.size)
+        n_trimmed = rank - len(s)
+        trimmed_eigenvalues = None
+        if n_trimmed > 0:
+            total_variance = self._sum_squares / (self.n_samples - 1)
+            residual = max(total_variance - np.sum(eigenvalues), 0)
+            trimmed_eigenvalues = np.repeat(residual / n_trimmed, n_trimmed)
+
+        return pca_model(self._components[:len(s)], eigenvalues, self._mean,
+                         self._template,
+                         trimmed_eigenvalues=trimmed_eigenvalues)
+
+
+# Randomized PCA --------------------------------------------------------------
+
+def randomized_pca_model(samples, max_n_components, n_oversamples=10,
+                         n_power_iterations=4, random_state=None):
+    r"""
+    Returns a :map:`PCAModel` of the leading components of the samples,
+    computed with a randomized truncated SVD (Halko et al.) rather than the
+    full decomposition.
+
+    The variance of the discarded components is kept, spread evenly among
+    them, so that the explained variance ratio and the noise variance of the
+    model are the same as for the full decomposition.
+
+    Parameters
+    ----------
+    samples : `list` of :map:`Vectorizable`
+        The samples.
+    max_n_components : `int` or `float`
+        If `int`, the number of components computed. If `float`, the
+        fraction of the variance that the components must explain at
+        least; the fewest components doing so are kept.
+    n_oversamples : `int`, optional
+        The number of additional random directions used to find the range
+        of the samples.
+    n_power_iterations : `int`, optional
+        The number of power iterations, which improve the accuracy of the
+        smaller components.
+    random_state : `int` or ``None``, optional
+        The seed of the random directions.
+
+    Returns
+    -------
+    pca_model : :map:`PCAModel`
+        The unbiased, centred PCA model.
+    """
+    X = np.array([s.as_vector() for s in samples])
+    n_samples, n_features = X.shape
+    mean = np.mean(X, axis=0)
+    X -= mean
+
+    rng = np.random.RandomState(random_state)
+    rank = min(n_samples - 1, n_features)
+    total_variance = np.einsum('ij,ij->', X, X) / (n_samples - 1)
+    fraction = not isinstance(max_n_components, numbers.Integral)
+    if fraction:
+        n_components = min(50, rank)
+    else:
+        n_components = min(int(max_n_components), rank)
+    while True:
+        s, components = _randomized_svd(X, n_components, n_oversamples,
+                                        n_power_iterations, rng)
+        eigenvalues = s**2 / (n_samples - 1)
+        # the variance fraction is met or all components are computed
+        if (not fraction or n_components == rank or
+                np.sum(eigenvalues) >= max_n_components * total_variance):
+            break
+        n_components = min(2 * n_components, rank)
+
+    # the variance of the components that were not computed is spread
+    # evenly among them
+    n_trimmed = rank - n_components
+    trimmed_eigenvalues = np.zeros(0)
+    if n_trimmed > 0:
+        residual = max(total_variance - np.sum(eigenvalues), 0)
+        trimmed_eigenvalues = np.repeat(residual / n_trimmed, n_trimmed)
+
+    if fraction:
+        # keep the fewest components explaining the variance fraction, as
+        # trim_components would, but keep the variance of the others
+        ratio = np.cumsum(eigenvalues) / total_variance
+        n_kept = min(int(np.sum(ratio < max_n_components)) + 1,
+                     n_components)
+        trimmed_eigenvalues = np.hstack((eigenvalues[n_kept:],
+                                         trimmed_eigenvalues))
+        eigenvalues = eigenvalues[:n_kept]
+        components = components[:n_kept]
+
+    if len(trimmed_eigenvalues) == 0:
+        trimmed_eigenvalues = None
+    return pca_model(components, eigenvalues, mean, samples[0],
+                     trimmed_eigenvalues=trimmed_eigenvalues)
+
+
+def _randomized_svd(X, n_components, n_oversamples, n_power_iterations,
+                    rng):
+    n_random = min(n_components + n_oversamples, min(X.shape))
+    # orthonormal basis approximating the range of X
+    Q = np.dot(X, rng.randn(X.shape[1], n_random))
+    for _ in range(n_power_iterations):
+        Q, _ = np.linalg.qr(Q)
+        Q = np.dot(X, np.dot(X.T, Q))
+    Q, _ = np.linalg.qr(Q)
+    # exact decomposition of the projection of X onto the basis
+    _, s, v = np.linalg.svd(np.dot(Q.T, X), full_matrices=False)
+    return s[:n_components], v[:n_components]
+
+
+# Out-of-core PCA -------------------------------------------------------------
+
+def matrix_pca_model(X, template_instance, chunk_size=2048):
+    r"""
+    Returns the :map:`PCAModel` of the rows of ``X``, which is read one
+    block of columns or rows at a time and never copied as a whole, e.g. an
+    `np.memmap` of samples that do not fit in memory.
+
+    As :map:`PCAModel`, the decomposition is computed from the Gram matrix
+    of the centred samples if there are fewer samples than features and
+    from their covariance matrix otherwise.
+
+    Parameters
+    ----------
+    X : ``(n_samples, n_features)`` `ndarray`
+        The vectorized samples.
+    template_instance : :map:`Vectorizable`
+        Template from which instances of the model are built.
+    chunk_size : `int`, optional
+        The number of columns or rows of ``X`` read at once.
+
+    Returns
+    -------
+    pca_model : :map:`PCAModel`
+        The unbiased, centred PCA model.
+    """
+    n_samples, n_features = X.shape
+    rows = [slice(a, a + chunk_size) for a in range(0, n_samples, chunk_size)]
+    columns = [slice(a, a + chunk_size)
+               for a in range(0, n_features, chunk_size)]
+
+    mean = np.zeros(n_features)
+    for r in rows:
+        mean += np.sum(X[r], axis=0)
+    mean /= n_samples
+
+    if n_samples <= n_features:
+        # eigenvectors of the Gram matrix are the projections of the
+        # samples onto the components
+        G = np.zeros((n_samples, n_samples))
+        for c in columns:
+            Xc = X[:, c] - mean[c]
+            G += np.dot(Xc, Xc.T)
+        eigenvalues, v = np.linalg.eigh(G)
+        eigenvalues, v = eigenvalues[::-1], v[:, ::-1]
+        n_components = np.sum(eigenvalues > 1e-10 * eigenvalues[0])
+        eigenvalues, v = eigenvalues[:n_components], v[:, :n_components]
+        components = np.empty((n_components, n_features))
+        for c in columns:
+            components[:, c] = np.dot(v.T, X[:, c] - mean[c])
+        components /= np.sqrt(eigenvalues)[:, None]
+    else:
+        C = np.zeros((n_features, n_features))
+        for r in rows:
+            Xr = X[r] - mean
+            C += np.dot(Xr.T, Xr)
+        eigenvalues, v = np.linalg.eigh(C)
+        eigenvalues, v = eigenvalues[::-1], v[:, ::-1]
+        n_components = min(n_samples - 1,
+                           np.sum(eigenvalues > 1e-10 * eigenvalues[0]))
+        eigenvalues = eigenvalues[:n_components]
+        components = v[:, :n_components].T
+
+    return pca_model(components, eigenvalues / (n_samples - 1), mean,
+                     template_instance)
+
+
+def build_pca_model(samples, max_n_components=None, randomized=False):
+    r"""
+    Returns the :map:`PCAModel` of the samples, trimmed to
+    ``max_n_components``.
+
+    Samples stored as :map:`MemmapImages` are decomposed out of core with
+    :map:`matrix_pca_model`, otherwise :map:`randomized_pca_model` is used if
+    ``randomized`` is ``True`` and ``max_n_components`` is given.
+
+    Parameters
+    ----------
+    samples : `list` of :map:`Vectorizable` or :map:`MemmapImages`
+        The samples.
+    max_n_components : `int` or `float` or ``None``, optional
+        The components kept, see ``PCAModel.trim_components``. If ``None``,
+        all of them are kept.
+    randomized : `bool`, optional
+        If ``True``, only the required components are computed.
+
+    Returns
+    -------
+    pca_model : :map:`PCAModel`
+        The unbiased, centred PCA model.
+    """
+    if isinstance(samples, MemmapImages):
+        model = matrix_pca_model(samples.vectors, samples.template)
+    elif randomized and max_n_components is not None:
+        # compute only the required components
+        return randomized_pca_model(samples, max_n_components)
+    else:
+        model = PCAModel(samples)
+    # trim model if required
+    if max_n_components is not None:
+        model.trim_components(max_n_components)
+    return model
+
+
+# Shape Models ----------------------------------------------------------------
+
+def build_shape_model(shapes, max_n_components=None):
+    r"""
+    Returns the :map:`PCAModel` of a set of shapes aligned with Generalized
+    Procrustes Analysis, equivalent to building it from the
+    ``aligned_source`` of every transform of menpo's
+    ``GeneralizedProcrustesAnalysis`` but computed on a single
+    ``(n_shapes, n_points, n_dims)`` array.
+
+    Parameters
+    ----------
+    shapes : `list` of :map:`PointCloud`
+        The shapes.
+    max_n_components : `int` or `float` or ``None``, optional
+        The components kept, see ``PCAModel.trim_components``. If ``None``,
+        all of them are kept.
+
+    Returns
+    -------
+    shape_model : :map:`PCAModel`
+        The unbiased, centred PCA model.
+    """
+    points = np.array([s.points for s in shapes])
+    # centralize shapes
+    points -= np.mean(points, axis=1)[:, None, :]
+    # align centralized shapes using Procrustes Analysis
+    aligned = generalized_procrustes_analysis(points)
+    X = aligned.reshape((len(shapes), -1))
+    model = matrix_pca_model(X, shapes[0].from_vector(X[0]))
+    if max_n_components is not None:
+        # trim shape model if required
+        model.trim_components(max_n_components)
+    return model
+
+
+def pca_model(components, eigenvalues, mean_vector, template_instance,
+              trimmed_eigenvalues=None):
+    r"""
+    Returns a :map:`PCAModel` from an already computed decomposition.
+
+    Parameters
+    ----------
+    components : ``(n_components, n_features)`` `ndarray`
+        The orthonormal principal components.
+    eigenvalues : ``(n_components,)`` `ndarray`
+        The variance along each component, in decreasing order.
+    mean_vector : ``(n_features,)`` `ndarray`
+        The mean of the samples.
+    template_instance : :map:`Vectorizable`
+        Template from which instances of the model are built.
+    trimmed_eigenvalues : ``(n_trimmed,)`` `ndarray` or ``None``, optional
+        The variance along the components that were discarded.
+
+    Returns
+    -------
+    pca_model : :map:`PCAModel`
+        The unbiased, centred PCA model.
+    """
+    model = PCAModel.__new__(PCAModel)
+    super(PCAModel, model).__init__(components, mean_vector,
+                                    template_instance)
+    model.centred = True
+    model.biased = False
+    model._eigenvalues = eigenvalues
+    model._n_active_components = int(model.n_components)
+    model._trimmed_eigenvalues = trimmed_eigenvalues
+    return model
@@ -0,0 +1,84 @@
+from __future__ import division
+import numpy as np
+
+
+# Array-native Generalized Procrustes Analysis --------------------------------
+
+def generalized_procrustes_analysis(points, max_iters=100, eps=1e-6):
+    r"""
+    Aligns a set of shapes to their mean with similarity transforms,
+    iterating as menpo's ``GeneralizedProcrustesAnalysis`` does but on a
+    single array, with the alignment of all shapes to the current target
+    computed at once.
+
+    The target starts as the mean of the shapes. At every iteration, all
+    shapes are aligned to the target and the new target is the mean of the
+    aligned shapes rescaled, about its centre, to the size of the initial
+    target. Iterations stop when the target moves less than ``eps``.
+
+    Parameters
+    ----------
+    points : ``(n_shapes, n_points, n_dims)`` `ndarray`
+        The shapes.
+    max_iters : `int`, optional
+        The maximum number of iterations.
+    eps : `float`, optional
+        The convergence tolerance on the norm of the change of the target.
+
+    Returns
+    -------
+    aligned_points : ``(n_shapes, n_points, n_dims)`` `ndarray`
+        The aligned shapes.
+    """
+    target = np.mean(points, axis=0)
+    initial_norm = _norm(target - target.mean(axis=0))
+    aligned = align_similarity(points, target)
+    for _ in range(max_iters - 1):
+        new_target = np.mean(aligned, axis=0)
+        # rescale the new target to the size of the initial one
+        centre = new_target.mean(axis=0)
+        new_target = ((new_target - centre) *
+                      (initial_norm / _norm(new_target - centre)) + centre)
+        if _norm(target - new_target) < eps:
+            break
+        target = new_target
+        aligned = align_similarity(points, target)
+    return aligned
+
+
+def align_similarity(points, target):
+    r"""
+    Aligns every shape to ``target`` with the similarity transform of
+    menpo's ``AlignmentSimilarity``: the centres are matched, the shapes
+    are rescaled to the norm of the target and rotated by the optimal
+    rotation, without reflections.
+
+    Parameters
+    ----------
+    points : ``(n_shapes, n_points, n_dims)`` `ndarray`
+        The shapes.
+    target : ``(n_points, n_dims)`` `ndarray`
+        The target shape.
+
+    Returns
+    -------
+    aligned_points : ``(n_shapes, n_points, n_dims)`` `ndarray`
+        The aligned shapes.
+    """
+    target_centre = target.mean(axis=0)
+    centred_target = target - target_centre
+    centred = points - points.mean(axis=1)[:, None, :]
+    norms = np.sqrt(np.einsum('npd,npd->n', centred, centred))
+    scales = _norm(centred_target) / norms
+    # optimal rotations, from the SVDs of all correlations at once
+    u, _, vt = np.linalg.svd(np.einsum('npi,pj->nij', centred,
+                                       centred_target))
+    reflections = np.linalg.det(np.einsum('nij,njk->nik', u, vt)) < 0
+    u[reflections, :, -1] *= -1
+    rotations = np.einsum('nij,njk->nik', u, vt)
+    return (scales[:, None, None] *
+            np.einsum('npi,nij->npj', centred, rotations) + target_centre)
+
+
+def _norm(points):
+    return np.sqrt(np.sum(points ** 2))
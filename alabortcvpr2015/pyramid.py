@@ -0,0 +1,126 @@
+from __future__ import division
+from scipy.ndimage import gaussian_filter
+
+from .cache import cached
+
+
+# Cascaded Image Pyramid ------------------------------------------------------
+
+class ImagePyramid(object):
+    r"""
+    Cascaded Gaussian pyramid shared by builders and fitters, so that both
+    produce identical levels.
+
+    Every level is obtained from the previous one rather than from the
+    highest resolution image: it is smoothed with a Gaussian filter to avoid
+    aliasing and rescaled by the ratio between the scales of both levels.
+    Depending on ``scale_features``, either the feature image of the first
+    level or the original image is cascaded, in which case the features
+    are computed at every level.
+
+    Parameters
+    ----------
+    scales : `list` of `float`
+        The scale of every level wrt the original image, in the order in
+        which levels are produced (from higher to lower resolution).
+    features : `callable` or ``None``, optional
+        The features. If ``None``, levels are the images themselves.
+    scale_features : `bool`, optional
+        If ``True``, the pyramid is applied to the feature image of the
+        first level. Otherwise, it is applied to the original image and the
+        features are computed at every level.
+    cache : :map:`ImageCache` or ``None``, optional
+        Cache of the features and rescaled images.
+    """
+    def __init__(self, scales, features=None, scale_features=True,
+                 cache=None):
+        self.scales = list(scales)
+        self.features = features
+        self.scale_features = scale_features
+        self.cache = cache
+
+    @property
+    def n_levels(self):
+        r"""
+        The number of levels.
+
+        :type: `int`
+        """
+        return len(self.scales)
+
+    def compute_features(self):
+        r"""
+        Returns the function computing the features of an image.
+        """
+        features = self.features
+        if features is None:
+            return lambda i: i
+        return cached(self.cache, features, 'features', features)
+
+    def rescale(self, level):
+        r"""
+        Returns the function obtaining an image of ``level`` from the
+        corresponding image of the previous level.
+        """
+        scale = self.scales[level] / self.scales[level - 1]
+        return cached(self.cache, lambda i: pyramid_rescale(i, scale),
+                      'pyramid_rescale', scale)
+
+    def levels(self, image):
+        r"""
+        Lazily generates the levels of an image. Only the images required
+        to obtain the next level are kept between levels.
+
+        Parameters
+        ----------
+        image : :map:`Image`
+            The image at the original scale.
+
+        Returns
+        -------
+        levels : `generator` of :map:`Image`
+            The image of every level, from higher to lower resolution.
+        """
+        compute_features = self.compute_features()
+        for j in range(self.n_levels):
+            if j == 0:
+                # compute features at highest level
+                level_image = compute_features(image)
+            elif self.scale_features:
+                # scale features of the previous level
+                level_image = self.rescale(j)(level_image)
+            else:
+                # scale image of the previous level and compute features
+                image = self.rescale(j)(image)
+                level_image = compute_features(image)
+            yield level_image
+
+
+def pyramid_rescale(image, scale):
+    r"""
+    Rescales an image, smoothing it first if it is downscaled so that the
+    result is not aliased.
+
+    The standard deviation of the Gaussian filter is ``1 / (3 * scale)``
+    pixels, the same as ``skimage.transform.pyramid_reduce``.
+
+    Parameters
+    ----------
+    image : :map:`Image`
+        The image, whose pixels are ``(n_channels, ...)``.
+    scale : `float`
+        The scale factor.
+
+    Returns
+    -------
+    rescaled_image : :map:`Image`
+        The rescaled image.
+    """
+    if scale < 1:
+        sigma = 1 / (3 * scale)
+        pixels = gaussian_filter(
+            image.pixels, [0] + [sigma] * (image.pixels.ndim - 1),
+            mode='nearest')
+        image = image.copy()
+        image.pixels = pixels
+    return image.rescale(scale)
@@ -0,0 +1,104 @@
+from __future__ import division
+import os
+import tempfile
+import numpy as np
+
+
+# Memory Mapped Storage of Images ---------------------------------------------
+
+class MemmapImages(object):
+    r"""
+    Sequence of images of the same kind and size whose vectorized pixels
+    are stored as the rows of a ``(n_images, n_features)`` `np.memmap`
+    rather than in memory.
+
+    The file backing the memmap is unlinked as soon as it is mapped, so its
+    space is reclaimed when the object is garbage collected.
+
+    Parameters
+    ----------
+    vectors : ``(n_images, n_features)`` `np.memmap`
+        The vectorized images.
+    template : :map:`Vectorizable`
+        The image from which images are rebuilt from their vectors.
+    """
+    def __init__(self, vectors, template):
+        self.vectors = vectors
+        self.template = template
+
+    @classmethod
+    def from_images(cls, images, n_images, directory, chunk_size=64):
+        r"""
+        Stores images, consuming them one at a time.
+
+        Parameters
+        ----------
+        images : `iterable` of :map:`Vectorizable`
+            The images.
+        n_images : `int`
+            The number of images.
+        directory : `str`
+            The directory of the file backing the memmap.
+        chunk_size : `int`, optional
+            The number of images written between flushes of the memmap.
+
+        Returns
+        -------
+        memmap_images : :map:`MemmapImages`
+            The stored images.
+        """
+        vectors = None
+        template = None
+        for k, image in enumerate(images):
+            v = image.as_vector()
+            if vectors is None:
+                template = image
+                fd, path = tempfile.mkstemp(suffix='.dat', dir=directory)
+                os.close(fd)
+                try:
+                    vectors = np.memmap(path, dtype=v.dtype, mode='w+',
+                                        shape=(n_images, v.size))
+                finally:
+                    os.remove(path)
+            vectors[k] = v
+            if (k + 1) % chunk_size == 0:
+                # write the chunk out so that its pages can be released
+                vectors.flush()
+        if vectors is None:
+            raise ValueError('At least one image is required')
+        vectors.flush()
+        return cls(vectors, template)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def __getitem__(self, k):
+        return self.template.from_vector(self.vectors[k])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+
+def store_images(images, n_images, directory=None):
+    r"""
+    Stores images, in memory if ``directory`` is ``None`` or as
+    :map:`MemmapImages` otherwise.
+
+    Parameters
+    ----------
+    images : `iterable` of :map:`Vectorizable`
+        The images, consumed one at a time.
+    n_images : `int`
+        The number of images.
+    directory : `str` or ``None``, optional
+        The directory of the file backing the memmap.
+
+    Returns
+    -------
+    images : `list` or :map:`MemmapImages`
+        The stored images.
+    """
+    if directory is None:
+        return list(images)
+    return MemmapImages.from_images(images, n_images, directory)
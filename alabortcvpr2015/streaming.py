@@ -0,0 +1,215 @@
+from __future__ import division
+import numbers
+from copy import deepcopy
+from itertools import islice
+import numpy as np
+from scipy.stats import multivariate_normal
+
+from menpo.transform import Scale, AlignmentUniformScale
+from menpo.shape import mean_pointcloud
+from menpo.visualize import print_dynamic, progress_bar_str
+
+from menpofit.base import build_sampling_grid
+
+from alabortcvpr2015.pca import IncrementalPCA
+from alabortcvpr2015.parallel import thread_pool, imap
+
+
+def build_streaming(builder, images, group, label, batch_size, verbose,
+                    appearance=False, classifiers=False, **kwargs):
+    r"""
+    Builds the models of a builder in two passes over the images, so that
+    only ``batch_size`` images are in memory at any time.
+
+    The first pass only reads the landmarks, from which the reference shape
+    and the shape models are built. The landmarks of the normalized and
+    scaled images are obtained by scaling the original ones, as the images
+    are. The second pass runs the per-image stages of the builder on
+    batches of images and folds the results into an :map:`IncrementalPCA`
+    and an :map:`IncrementalMCF` per landmark for every level. As in
+    :map:`build_classifiers`, if the parts have more channels than there are
+    samples, the parts are kept instead and the filters are solved in the
+    sample space by :map:`MCF`, since the parts are then smaller than the
+    statistics.
+
+    Parameters
+    ----------
+    builder : :map:`AAMBuilder` or :map:`CLMBuilder` or :map:`UnifiedBuilder`
+        The builder.
+    images : `callable` or `iterable` of :map:`Image`
+        Either a callable returning a new iterator over the images, e.g.
+        ``lambda: mio.import_images(path)``, or an iterable that can be
+        iterated twice.
+    batch_size : `int`
+        The number of images processed at once in the second pass.
+    appearance : `bool`, optional
+        If ``True``, appearance models are built.
+    classifiers : `bool`, optional
+        If ``True``, classifiers are built. Only :map:`MCF` are supported.
+    kwargs : `dict`
+        Passed to the classifiers.
+
+    Returns
+    -------
+    reference_shape : :map:`PointCloud`
+        The reference shape.
+    shape_models : `list` of :map:`PCAModel`
+        The shape models, from higher to lower resolution.
+    appearance_models : `list` of :map:`PCAModel` or ``None``
+        The appearance models, from higher to lower resolution.
+    classifiers : `list` of :map:`MultipleMCF` or ``None``
+        The classifiers, from higher to lower resolution.
+    """
+    if classifiers and builder.classifier is not MCF:
+        raise ValueError('Streaming builds only support MCF classifiers')
+    if not callable(images):
+        if iter(images) is images:
+            raise ValueError('images must be an iterable that can be '
+                             'iterated twice or a callable returning an '
+                             'iterator')
+        iterable = images
+        images = lambda: iter(iterable)
+
+    # first pass: reference shape and shape models
+    if verbose:
+        print_dynamic('- Computing reference shape')
+    shapes = [i.landmarks[group][label] for i in images()]
+    n_images = len(shapes)
+    reference_shape = mean_pointcloud(shapes)
+    # fix the reference_shape's diagonal length if specified
+    if builder.diagonal:
+        x, y = reference_shape.range()
+        scale = builder.diagonal / np.sqrt(x**2 + y**2)
+        Scale(scale, reference_shape.n_dims).apply_inplace(reference_shape)
+    # images are normalized wrt the reference_shape size
+    shapes = [AlignmentUniformScale(s, reference_shape).apply(s)
+              for s in shapes]
+
+    if verbose:
+        print_dynamic('- Building shape models')
+    shape_models = []
+    for j, s in enumerate(builder.scales):
+        if j == 0 or builder.scale_shapes:
+            level_shapes = shapes
+            if j > 0:
+                level_shapes = [Scale(s, x.n_dims).apply(x) for x in shapes]
+            shape_model = builder._build_shape_model(
+                level_shapes, builder.max_shape_components)
+            shape_models.append(shape_model)
+        else:
+            shape_models.append(deepcopy(shape_model))
+    mean_shapes = [sm.mean() for sm in shape_models]
+
+    # second pass: accumulate appearance models and classifiers
+    n_levels = len(builder.scales)
+    if appearance:
+        max_n_components = builder.max_appearance_components
+        if not isinstance(max_n_components, numbers.Integral):
+            max_n_components = None
+        pcas = [IncrementalPCA(max_n_components) for _ in range(n_levels)]
+    if classifiers:
+        # build desired responses
+        mvn = multivariate_normal(mean=np.zeros(2), cov=builder.covariance)
+        grid = build_sampling_grid(builder.parts_shape)
+        Y = [mvn.pdf(grid + offset) for offset in builder.offsets]
+        clfs = [None] * n_levels
+
+    c = 0
+    iterator = images()
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        batch = builder._normalize_images(batch, group, label,
+                                          reference_shape, False)
+        for j in range(n_levels):
+            # obtain image representation
+            if j == 0:
+                level_images = builder._compute_features(batch, '', False)
+            elif builder.scale_features:
+                level_images = builder._scale_images(level_images, j, '',
+                                                     False)
+            else:
+                batch = builder._scale_images(batch, j, '', False)
+                level_images = builder._compute_features(batch, '', False)
+            level_shapes = [i.landmarks[group][label] for i in level_images]
+
+            if appearance or (classifiers and
+                               not hasattr(builder, '_parts_images')):
+                warped_images = builder._warp_images(
+                    level_images, level_shapes, mean_shapes[j], '', False)
+            if appearance:
+                pcas[j].increment(warped_images)
+
+            if classifiers:
+                if hasattr(builder, '_parts_images'):
+                    parts_images = builder._parts_images(
+                        level_images, level_shapes, '', False)
+                else:
+                    # parts images are warped images
+                    parts_images = warped_images
+                for parts_image in parts_images:
+                    if clfs[j] is None:
+                        n_offsets, n_channels = parts_image.pixels.shape[1:3]
+                        if n_channels <= n_images * n_offsets:
+                            clfs[j] = [IncrementalMCF(Y, **kwargs)
+                                       for _ in parts_image.pixels]
+                        else:
+                            clfs[j] = [[] for _ in parts_image.pixels]
+                    for clf, x in zip(clfs[j], parts_image.pixels):
+                        if isinstance(clf, list):
+                            clf.append(x)
+                        else:
+                            clf.increment(x)
+
+        c += len(batch)
+        if verbose:
+            print_dynamic('- Processing images: {}'.format(
+                progress_bar_str(c / n_images, show_bar=False)))
+        batch = list(islice(iterator, batch_size))
+
+    if verbose:
+        print_dynamic('- Building models\n')
+    appearance_models = [] if appearance else None
+    multiple_clfs = [] if classifiers else None
+    pool = thread_pool(builder.n_jobs)
+    try:
+        for j in range(n_levels):
+            if verbose:
+                if n_levels > 1:
+                    level_str = '  - Level {}: '.format(j)
+                else:
+                    level_str = '  - '
+            if appearance:
+                if verbose:
+                    print_dynamic('{}Building appearance model'.format(
+                        level_str))
+                appearance_model = pcas[j].finalize()
+                pcas[j] = None
+                # trim appearance model if required
+                if builder.max_appearance_components is not None:
+                    appearance_model.trim_components(
+                        builder.max_appearance_components)
+                appearance_models.append(appearance_model)
+            if classifiers:
+                if verbose:
+                    print_dynamic('{}Building classifiers'.format(level_str))
+                multiple_clfs.append(MultipleMCF(list(imap(
+                    pool, lambda clf: _finalize_classifier(clf, Y, kwargs),
+                    clfs[j]))))
+                clfs[j] = None
+            if verbose:
+                print_dynamic('{}Done\n'.format(level_str))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return reference_shape, shape_models, appearance_models, multiple_clfs
+
+
+def _finalize_classifier(clf, Y, kwargs):
+    if isinstance(clf, list):
+        # the parts of every image, solved in the sample space
+        return MCF(clf, Y, **kwargs)
+    return clf.finalize()
+
+
+from alabortcvpr2015.clm.classifier import MCF, IncrementalMCF, MultipleMCF
@@ -0,0 +1,66 @@
+import os
+import types
+import functools
+import tempfile
+import numpy as np
+
+from alabortcvpr2015.cache import ImageCache, fingerprint
+
+
+def _hog(image):
+    return image
+
+
+def _dsift(image):
+    return image
+
+
+def _feature(image):
+    return extract(image)
+
+
+class _Scale(object):
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def __call__(self, image):
+        return image * self.factor
+
+
+class _Pixels(object):
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+
+def test_fingerprint_differs_with_called_globals():
+    assert (fingerprint(lambda i: _hog(i)) !=
+            fingerprint(lambda i: _dsift(i)))
+
+
+def test_fingerprint_differs_with_global_values():
+    # same code and names, resolved to different functions
+    hog = types.FunctionType(_feature.__code__, {'extract': _hog})
+    dsift = types.FunctionType(_feature.__code__, {'extract': _dsift})
+    assert fingerprint(hog) != fingerprint(dsift)
+
+
+def test_fingerprint_of_callable_instances_and_partials():
+    assert fingerprint(_Scale(2)) == fingerprint(_Scale(2))
+    assert fingerprint(_Scale(2)) != fingerprint(_Scale(3))
+    assert (fingerprint(functools.partial(_Scale(2), 1)) ==
+            fingerprint(functools.partial(_Scale(2), 1)))
+    assert (fingerprint(functools.partial(_hog, 1)) !=
+            fingerprint(functools.partial(_dsift, 1)))
+
+
+def test_cache_size_is_bounded():
+    path = tempfile.mkdtemp()
+    cache = ImageCache(path, max_size=20000)
+    for k in range(20):
+        cache.put(str(k), _Pixels(np.zeros(500)))
+    size = sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
+    assert size <= 20000
+    assert cache._size == size
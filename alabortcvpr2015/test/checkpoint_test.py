@@ -0,0 +1,50 @@
+import types
+import tempfile
+
+from alabortcvpr2015.checkpoint import build_checkpoint
+
+
+def _hog(image):
+    return image
+
+
+def _dsift(image):
+    return image
+
+
+def _feature(image):
+    return extract(image)
+
+
+class _Builder(object):
+
+    def __init__(self, features, checkpoint_dir, n_jobs=1):
+        self.features = features
+        self.checkpoint_dir = checkpoint_dir
+        self.n_jobs = n_jobs
+
+
+def _features(extract):
+    # same code, different globals
+    return types.FunctionType(_feature.__code__, {'extract': extract})
+
+
+def test_checkpoint_resumes_with_same_configuration():
+    path = tempfile.mkdtemp()
+    checkpoint = build_checkpoint(_Builder(_features(_hog), path), [],
+                                  'PTS', 'all')
+    checkpoint.save('level_0', 1)
+    checkpoint = build_checkpoint(_Builder(_features(_hog), path, n_jobs=4),
+                                  [], 'PTS', 'all')
+    assert 'level_0' in checkpoint
+    assert checkpoint.load('level_0') == 1
+
+
+def test_feature_change_invalidates_checkpoint():
+    path = tempfile.mkdtemp()
+    checkpoint = build_checkpoint(_Builder(_features(_hog), path), [],
+                                  'PTS', 'all')
+    checkpoint.save('level_0', 1)
+    checkpoint = build_checkpoint(_Builder(_features(_dsift), path), [],
+                                  'PTS', 'all')
+    assert 'level_0' not in checkpoint
@@ -0,0 +1,49 @@
+import os
+import signal
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from alabortcvpr2015.parallel import map_images, imap_images
+
+
+class _Image(object):
+    def __init__(self, pixels, name):
+        self.pixels = pixels
+        self.name = name
+
+
+def _images(n_images=20):
+    return [_Image(np.full((1, 4, 4), k, dtype=np.float64), k)
+            for k in range(n_images)]
+
+
+def _increment(image):
+    return _Image(image.pixels + 1, image.name)
+
+
+def _die_on_fifth(image):
+    if image.name == 5:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return _increment(image)
+
+
+def test_map_images_matches_serial_map():
+    images = _images()
+    results = map_images(_increment, images, n_jobs=3)
+    assert [r.name for r in results] == list(range(len(images)))
+    for r, i in zip(results, images):
+        assert_array_equal(r.pixels, i.pixels + 1)
+
+
+def test_imap_images_raises_when_a_worker_dies():
+    names = []
+    try:
+        for r in imap_images(_die_on_fifth, _images(), n_jobs=3):
+            names.append(r.name)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('RuntimeError not raised')
+    # the images before the chunk of the dead worker are returned
+    assert names == list(range(len(names)))
+    assert len(names) <= 5
@@ -0,0 +1,72 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from menpo.model import PCAModel
+from menpofast.image import Image
+
+from alabortcvpr2015.pca import IncrementalPCA, randomized_pca_model
+
+
+def _images(n_images=40, n_components=6, shape=(2, 10, 10), seed=0):
+    # images of a low rank appearance plus noise
+    rng = np.random.RandomState(seed)
+    n_features = np.prod(shape)
+    X = (3 * rng.randn(n_images, n_components).dot(
+        rng.randn(n_components, n_features)) +
+        0.1 * rng.randn(n_images, n_features) + 5)
+    return [Image(x.reshape(shape)) for x in X]
+
+
+def _streamed_model(images, max_n_components, batch_size=7):
+    pca = IncrementalPCA(max_n_components)
+    for start in range(0, len(images), batch_size):
+        pca.increment(images[start:start + batch_size])
+    return pca.finalize()
+
+
+def test_incremental_pca_noise_variance():
+    images = _images()
+    batch_model = PCAModel(images)
+    batch_model.trim_components(6)
+    model = _streamed_model(images, 6)
+    model.trim_components(6)
+    assert model.noise_variance() > 0
+    assert_allclose(model.noise_variance(), batch_model.noise_variance(),
+                    rtol=1e-4)
+    assert_allclose(model.eigenvalues, batch_model.eigenvalues, rtol=1e-4)
+
+
+def test_incremental_pca_exact_without_max_n_components():
+    images = _images()
+    batch_model = PCAModel(images)
+    batch_model.trim_components(6)
+    model = _streamed_model(images, None)
+    model.trim_components(6)
+    assert_allclose(model.noise_variance(), batch_model.noise_variance())
+    assert_allclose(model.eigenvalues, batch_model.eigenvalues)
+
+
+def test_randomized_pca_n_components():
+    images = _images()
+    batch_model = PCAModel(images)
+    batch_model.trim_components(6)
+    for n_components in (6, np.int64(6)):
+        model = randomized_pca_model(images, n_components, random_state=0)
+        assert model.n_components == 6
+        assert_allclose(model.eigenvalues, batch_model.eigenvalues,
+                        rtol=1e-4)
+        assert_allclose(model.noise_variance(),
+                        batch_model.noise_variance(), rtol=1e-4)
+
+
+def test_randomized_pca_variance_fraction():
+    # more samples than the components computed at first, so that the
+    # variance of the ones not computed is spread
+    images = _images(n_images=80)
+    batch_model = PCAModel(images)
+    batch_model.trim_components(0.95)
+    model = randomized_pca_model(images, 0.95, random_state=0)
+    assert model.n_components == batch_model.n_components
+    assert_allclose(model.eigenvalues, batch_model.eigenvalues, rtol=1e-4)
+    assert_allclose(model.noise_variance(), batch_model.noise_variance(),
+                    rtol=1e-4)
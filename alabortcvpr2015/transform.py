@@ -273,6 +273,37 @@ class GlobalMDTransform(ModelDrivenTransform):
         self._cached_points = None
         self.transform = transform_cls(source, self.target)
 
+    # (n_parameters, points, dW_dq, dW_db_0, dW_dp_0) of the last call to jp
+    _jp_cache = None
+
+    def _jp_mean_terms(self):
+        # the terms of jp evaluated at p=0 only depend on the mean shape and
+        # on the active components of the model, hence they are computed
+        # again only if the number of parameters changes
+        n_parameters = self.n_parameters
+        if self._jp_cache is None or self._jp_cache[0] != n_parameters:
+            # the incremental warp is always evaluated at p=0, ie the mean
+            # shape
+            points = self.pdm.model.mean().points
+
+            # dW/dq when p=0 and when p!=0 are the same and given by the
+            # Jacobian of the global transform evaluated at the mean of the
+            # model
+            # (n_points, n_global_params, n_dims)
+            dW_dq = self.pdm._global_transform_d_dp(points)
+
+            # dW/db when p=0, is the Jacobian of the model
+            # (n_points, n_weights, n_dims)
+            dW_db_0 = PDM.d_dp(self.pdm, points)
+
+            # dW/dp when p=0, is simply the concatenation of the previous
+            # two terms
+            # (n_points, n_params, n_dims)
+            dW_dp_0 = np.hstack((dW_dq, dW_db_0))
+
+            self._jp_cache = (n_parameters, points, dW_dq, dW_db_0, dW_dp_0)
+        return self._jp_cache[1:]
+
     def jp(self):
         r"""
         Composes two ModelDrivenTransforms together based on the
@@ -297,28 +328,13 @@ class GlobalMDTransform(ModelDrivenTransform):
                Algorithms for Inverse Compositional Active Appearance Model
                Fitting", CVPR08
         """
-        # the incremental warp is always evaluated at p=0, ie the mean shape
-        points = self.pdm.model.mean().points
-
         # compute:
         #   - dW/dp when p=0
         #   - dW/dp when p!=0
         #   - dW/dx when p!=0 evaluated at the source landmarks
 
-        # dW/dq when p=0 and when p!=0 are the same and given by the
-        # Jacobian of the global transform evaluated at the mean of the
-        # model
-        # (n_points, n_global_params, n_dims)
-        dW_dq = self.pdm._global_transform_d_dp(points)
-
-        # dW/db when p=0, is the Jacobian of the model
-        # (n_points, n_weights, n_dims)
-        dW_db_0 = PDM.d_dp(self.pdm, points)
-
-        # dW/dp when p=0, is simply the concatenation of the previous
-        # two terms
-        # (n_points, n_params, n_dims)
-        dW_dp_0 = np.hstack((dW_dq, dW_db_0))
+        # dW/dq, dW/db and dW/dp when p=0, evaluated at the mean shape
+        points, dW_dq, dW_db_0, dW_dp_0 = self._jp_mean_terms()
 
         # by application of the chain rule dW_db when p!=0,
         # is the Jacobian of the global transform wrt the points times
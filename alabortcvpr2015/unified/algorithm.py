@@ -10,6 +10,7 @@ from menpofit.base import build_sampling_grid
 from .result import UnifiedAlgorithmResult
 
 from alabortcvpr2015.aam.algorithm import PartsAAMInterface
+from alabortcvpr2015.batch import LockstepState, batch_solve, batch_results
 
 
 multivariate_normal = None  # expensive, from scipy.stats
@@ -61,6 +62,47 @@ class UnifiedAlgorithm(object):
     def run(self, image, initial_shape, max_iters=20, gt_shape=None, **kwargs):
         pass
 
+    @abc.abstractmethod
+    def run_batch(self, images, initial_shapes, max_iters=20, gt_shapes=None,
+                  **kwargs):
+        pass
+
+    def _batch_clm_error(self, images, targets, warped):
+        # (shape) errors of a batch of images, whose responses are computed
+        # at once
+        n_images = len(images)
+        # points: n_images x n_parts x n_dims
+        points = np.array([t.points for t in targets])
+        # get all (x, y) pairs being considered
+        xys = points[:, :, None, None, ...] + self._sampling_grid
+
+        # build parts images
+        if isinstance(self.interface, PartsAAMInterface):
+            # the warped images are the parts images
+            parts_pixels = warped.reshape(
+                (n_images,) + self.template.pixels.shape)
+        else:
+            parts_pixels = np.array([build_parts_image(
+                i, t, parts_shape=self.parts_shape,
+                normalize_parts=self.normalize_parts).pixels
+                for i, t in zip(images, targets)])
+
+        # compute parts responses
+        parts_response = self.multiple_clf(parts_pixels)
+        parts_response[np.logical_not(np.isfinite(parts_response))] = .5
+
+        # compute parts kernels
+        parts_kernel = parts_response * self._kernel_grid
+        parts_kernel /= np.sum(
+            parts_kernel, axis=(-2, -1))[..., None, None]
+
+        # compute mean shift targets
+        mean_shift_target = np.sum(parts_kernel[..., None] * xys,
+                                   axis=(-3, -2))
+
+        return (mean_shift_target.reshape((n_images, -1)) -
+                points.reshape((n_images, -1)))
+
 
 # Concrete Implementations of AAM Algorithm -----------------------------------
 
@@ -208,6 +250,55 @@ class PICRLMS(UnifiedAlgorithm):
         return UnifiedAlgorithmResult(image, self, shape_parameters,
                                       gt_shape=gt_shape)
 
+    def run_batch(self, images, initial_shapes, gt_shapes=None, max_iters=20,
+                  prior=False, a=0.5):
+        r"""
+        Fits several images in lockstep, see :map:`LockstepState`. The
+        results are the same as the ones of :meth:`run` on every image.
+        """
+        state = LockstepState(self.transform, initial_shapes, self.eps)
+        # masked model mean
+        masked_m = self.appearance_model.mean().as_vector()[
+            self.interface.image_vec_mask]
+
+        for _ in xrange(max_iters):
+            if state.n_active == 0:
+                break
+
+            active_images = [images[n] for n in state.active]
+            targets = state.active_targets()
+
+            # AAM part --------------------------------------------------------
+
+            # compute warped images with current weights
+            i = self.interface.warp_batch(active_images, targets)
+
+            # compute error images
+            e_aam = masked_m - i[:, self.interface.image_vec_mask]
+
+            # CLM part --------------------------------------------------------
+
+            e_clm = self._batch_clm_error(active_images, targets, i)
+
+            # Unified ---------------------------------------------------------
+
+            # compute gauss-newton parameter updates
+            if prior:
+                b = (self._j_prior * state.active_parameters() -
+                     a * e_aam.dot(self._j_aam) -
+                     (1 - a) * e_clm.dot(self._j_clm))
+                dp = -b.dot(self._inv_h_prior.T)
+            else:
+                dp = (e_aam.dot(self._pinv_j_aam.T) +
+                      e_clm.dot(self._pinv_j_clm.T))
+
+            # update transforms and test convergence
+            state.update(dp)
+
+        # return dm algorithm results
+        return batch_results(UnifiedAlgorithmResult, images, self, state,
+                             gt_shapes)
+
 
 class AICRLMS(UnifiedAlgorithm):
     r"""
@@ -356,3 +447,79 @@ class AICRLMS(UnifiedAlgorithm):
         return UnifiedAlgorithmResult(
             image, self, shape_parameters,
             appearance_parameters=appearance_parameters, gt_shape=gt_shape)
+
+    def run_batch(self, images, initial_shapes, gt_shapes=None, max_iters=20,
+                  prior=False, a=0.5):
+        r"""
+        Fits several images in lockstep, see :map:`LockstepState`. The
+        results are the same as the ones of :meth:`run` on every image.
+        """
+        state = LockstepState(self.transform, initial_shapes, self.eps)
+        # initial appearance parameters
+        appearance_parameters = [[0] for _ in images]
+        # model mean
+        m = self.appearance_model.mean().as_vector()
+        # masked model mean
+        masked_m = m[self.interface.image_vec_mask]
+        n_parameters = self.transform.n_parameters
+
+        for _ in xrange(max_iters):
+            if state.n_active == 0:
+                break
+
+            active_images = [images[n] for n in state.active]
+            targets = state.active_targets()
+
+            # AAM part --------------------------------------------------------
+
+            # warp images
+            i = self.interface.warp_batch(active_images, targets)
+            # mask images
+            masked_i = i[:, self.interface.image_vec_mask]
+
+            # reconstruct appearances
+            c = (masked_i - masked_m).dot(self._pinv_U)
+            t = c.dot(self._U.T) + m
+            for k, n in enumerate(state.active):
+                appearance_parameters[n].append(c[k])
+
+            # compute (image) errors
+            e_aam = t[:, self.interface.image_vec_mask] - masked_i
+
+            # compute AAM hessians and jacobians, the gradient of every
+            # reconstructed appearance being different
+            h_aam = np.empty((state.n_active, n_parameters, n_parameters))
+            je_aam = np.empty((state.n_active, n_parameters))
+            for k in xrange(state.n_active):
+                self.template.from_vector_inplace(t[k])
+                nabla_t = self.interface.gradient(self.template)
+                j = self.interface.steepest_descent_images(nabla_t,
+                                                           self._dw_dp)
+                j_aam = self._inv_sigma2 * j
+                h_aam[k] = j_aam.T.dot(j)
+                je_aam[k] = j_aam.T.dot(e_aam[k])
+
+            # CLM part --------------------------------------------------------
+
+            e_clm = self._batch_clm_error(active_images, targets, i)
+
+            # Unified part ----------------------------------------------------
+
+            # compute Gauss-Newton parameter updates
+            if prior:
+                h = a * h_aam + (1 - a) * self._h_clm + self._h_prior
+                b = (self._j_prior * state.active_parameters() -
+                     a * je_aam - (1 - a) * e_clm.dot(self._j_clm))
+                dp = -batch_solve(h, b)
+            else:
+                dp = batch_solve(a * h_aam + (1 - a) * self._h_clm,
+                                 a * je_aam +
+                                 (1 - a) * e_clm.dot(self._j_clm))
+
+            # update transforms and test convergence
+            state.update(dp)
+
+        # return Unified algorithm results
+        return batch_results(UnifiedAlgorithmResult, images, self, state,
+                             gt_shapes,
+                             appearance_parameters=appearance_parameters)
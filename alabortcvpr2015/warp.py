@@ -0,0 +1,246 @@
+from __future__ import division
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from menpo.shape import TriMesh
+from menpo.transform import PiecewiseAffine
+
+from menpofast.image import MaskedImage
+
+
+# Piecewise Affine Warp Engine ------------------------------------------------
+
+class PiecewiseAffineWarp(object):
+    r"""
+    Piecewise affine warp of images onto a fixed reference frame.
+
+    The triangle containing every true pixel of the reference ``mask`` and
+    its barycentric coordinates only depend on the reference frame, so they
+    are computed once and stored as a sparse ``(n_true_pixels, n_points)``
+    matrix. Warping an image then reduces to mapping the target points
+    through this matrix and a bilinear gather of the image pixels, which is
+    equivalent to ``image.warp_to_mask(mask, PiecewiseAffine(source,
+    target))``: points sampled outside the image are set to ``0``.
+
+    Parameters
+    ----------
+    mask : :map:`BooleanImage`
+        The mask of the reference frame.
+    source : :map:`PointCloud` or :map:`TriMesh`
+        The landmarks of the reference frame. If they are not a
+        :map:`TriMesh`, they are triangulated as :map:`PiecewiseAffine`
+        does.
+    """
+    def __init__(self, mask, source):
+        self.mask = mask
+        trilist = getattr(source, 'trilist', None)
+        if trilist is None:
+            trilist = TriMesh(source.points).trilist
+        self.n_points = source.n_points
+        self.trilist = trilist
+        mask_pixels = np.asarray(mask.pixels, dtype=bool).reshape(
+            mask.shape)
+        self._true_indices = np.flatnonzero(mask_pixels)
+        self._weights = _barycentric_weights(
+            source.points, trilist, mask.true_indices())
+        # preallocated pixels of the warps reusing their buffer
+        self._buffer = None
+
+    @property
+    def n_true_pixels(self):
+        r"""
+        The number of true pixels of the reference frame.
+
+        :type: `int`
+        """
+        return self._true_indices.size
+
+    def sample_points(self, target):
+        r"""
+        Returns the points of the image sampled by every true pixel of the
+        reference frame.
+
+        Parameters
+        ----------
+        target : ``(n_points, 2)`` `ndarray` or :map:`PointCloud`
+            The landmarks on the image.
+
+        Returns
+        -------
+        points : ``(n_true_pixels, 2)`` `ndarray`
+            The sampled points.
+        """
+        return self._weights.dot(getattr(target, 'points', target))
+
+    def warp(self, image, target, reuse_buffer=False):
+        r"""
+        Warps ``image`` onto the reference frame.
+
+        Parameters
+        ----------
+        image : :map:`Image`
+            The image.
+        target : ``(n_points, 2)`` `ndarray` or :map:`PointCloud`
+            The landmarks on the image corresponding to the ones of the
+            reference frame.
+        reuse_buffer : `bool`, optional
+            If ``True``, the pixels of the warped image are written into a
+            buffer owned by this object, hence they are only valid until
+            the next warp reusing the buffer.
+
+        Returns
+        -------
+        warped_image : :map:`MaskedImage`
+            The warped image.
+        """
+        pixels = image.pixels
+        shape = (pixels.shape[0],) + self.mask.shape
+        dtype = pixels.dtype if pixels.dtype.kind == 'f' else np.float64
+        if reuse_buffer:
+            if (self._buffer is None or self._buffer.shape != shape or
+                    self._buffer.dtype != dtype):
+                self._buffer = np.zeros(shape, dtype=dtype)
+            warped = self._buffer
+        else:
+            warped = np.zeros(shape, dtype=dtype)
+        warped.reshape((shape[0], -1))[:, self._true_indices] = \
+            _bilinear_sample(pixels, self.sample_points(target))
+        return MaskedImage(warped, mask=self.mask.copy(), copy=False)
+
+    def warp_vectors(self, images, targets):
+        r"""
+        Warps several images onto the reference frame at once and returns
+        the vectorized warped images, i.e. the ``as_vector()`` of the
+        images returned by :meth:`warp`. The points sampled by all images
+        are obtained with a single product of the barycentric matrix.
+
+        Parameters
+        ----------
+        images : `list` of :map:`Image`
+            The images, with the same number of channels.
+        targets : `list` of ``(n_points, 2)`` `ndarray` or :map:`PointCloud`
+            The landmarks on every image.
+
+        Returns
+        -------
+        vectors : ``(n_images, n_channels * n_true_pixels)`` `ndarray`
+            The vectorized warped images.
+        """
+        points = self._weights.dot(np.hstack(
+            [getattr(t, 'points', t) for t in targets]))
+        vectors = None
+        for k, image in enumerate(images):
+            pixels = image.pixels
+            v = _bilinear_sample(pixels, points[:, 2 * k:2 * k + 2]).ravel()
+            if vectors is None:
+                dtype = (pixels.dtype if pixels.dtype.kind == 'f'
+                         else np.float64)
+                vectors = np.empty((len(images), v.size), dtype=dtype)
+            vectors[k] = v
+        return vectors
+
+
+def is_piecewise_affine(transform):
+    r"""
+    Returns ``True`` if ``transform`` (an instance or a class) is a
+    :map:`PiecewiseAffine`, i.e. if :map:`PiecewiseAffineWarp` can replace
+    it.
+    """
+    if isinstance(transform, type):
+        return issubclass(transform, PiecewiseAffine)
+    return isinstance(transform, PiecewiseAffine)
+
+
+# the most recently used warps, by content of their reference frame
+_warps = OrderedDict()
+_max_cached_warps = 8
+
+
+def piecewise_affine_warp(mask, source):
+    r"""
+    Returns the :map:`PiecewiseAffineWarp` of a reference frame, reusing
+    the one of a previous call with the same reference frame.
+
+    Parameters
+    ----------
+    mask : :map:`BooleanImage`
+        The mask of the reference frame.
+    source : :map:`PointCloud` or :map:`TriMesh`
+        The landmarks of the reference frame.
+
+    Returns
+    -------
+    warp : :map:`PiecewiseAffineWarp`
+        The warp.
+    """
+    h = hashlib.sha1()
+    for a in (mask.pixels, source.points, getattr(source, 'trilist', None)):
+        if a is not None:
+            a = np.ascontiguousarray(a)
+            h.update(repr((a.dtype.str, a.shape)).encode('utf-8'))
+            h.update(a.data)
+    key = h.hexdigest()
+    warp = _warps.pop(key, None)
+    if warp is None:
+        warp = PiecewiseAffineWarp(mask, source)
+    _warps[key] = warp
+    while len(_warps) > _max_cached_warps:
+        _warps.popitem(last=False)
+    return warp
+
+
+def _barycentric_weights(points, trilist, indices, chunk_size=4096):
+    # sparse matrix mapping the triangle vertices to the pixels
+    v0 = points[trilist[:, 0]]
+    e1 = points[trilist[:, 1]] - v0
+    e2 = points[trilist[:, 2]] - v0
+    det = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+
+    n = indices.shape[0]
+    tri_index = np.empty(n, dtype=int)
+    weights = np.empty((n, 3))
+    for start in range(0, n, chunk_size):
+        d = indices[start:start + chunk_size, None, :] - v0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            alpha = (d[..., 0] * e2[:, 1] - d[..., 1] * e2[:, 0]) / det
+            beta = (e1[:, 0] * d[..., 1] - e1[:, 1] * d[..., 0]) / det
+        gamma = 1 - alpha - beta
+        # the most interior triangle, which contains the pixel unless it is
+        # (numerically) outside all of them
+        interior = np.minimum(np.minimum(alpha, beta), gamma)
+        interior[np.isnan(interior)] = -np.inf
+        t = np.argmax(interior, axis=1)
+        rows = np.arange(t.size)
+        tri_index[start:start + chunk_size] = t
+        weights[start:start + chunk_size] = np.column_stack(
+            (gamma[rows, t], alpha[rows, t], beta[rows, t]))
+
+    return csr_matrix((weights.ravel(), trilist[tri_index].ravel(),
+                       np.arange(0, 3 * n + 1, 3)),
+                      shape=(n, points.shape[0]))
+
+
+def _bilinear_sample(pixels, points):
+    # bilinear interpolation of (n_channels, h, w) pixels at (n, 2) points,
+    # 0 outside the image
+    n_channels, h, w = pixels.shape
+    y, x = points[:, 0], points[:, 1]
+    inside = (y >= 0) & (y <= h - 1) & (x >= 0) & (x <= w - 1)
+    y0 = np.clip(np.floor(y), 0, h - 1).astype(int)
+    x0 = np.clip(np.floor(x), 0, w - 1).astype(int)
+    y1 = np.minimum(y0 + 1, h - 1)
+    x1 = np.minimum(x0 + 1, w - 1)
+    dy = (y - y0) * inside
+    dx = (x - x0) * inside
+    w11 = dy * dx
+    w10 = dy - w11
+    w01 = dx - w11
+    w00 = inside - dy - dx + w11
+
+    flat = pixels.reshape((n_channels, -1))
+    y0 *= w
+    y1 *= w
+    return (flat[:, y0 + x0] * w00 + flat[:, y0 + x1] * w01 +
+            flat[:, y1 + x0] * w10 + flat[:, y1 + x1] * w11)